@@ -0,0 +1,202 @@
+import numpy as np
+
+import os
+import json
+import time
+
+from vectorStore import SEARCH_BLOCK_SIZE, normalize, top_k, group_sums, save_npy
+
+'''
+   Index de recherche approximative des plus proches voisins (ANN) pour le VectorStore natif.
+
+   Deux types d'index sont disponibles :
+       - "ivf"  : index à listes inversées en NumPy pur. Les embeddings sont regroupés par k-means sphérique en NLIST
+                  groupes ; une recherche ne parcourt que les nprobe groupes dont le centre est le plus proche.
+       - "hnsw" : graphe HNSW construit avec hnswlib (pip install hnswlib), paramètre de recherche ef.
+
+   L'index est construit par generateStore (ANN_INDEX) dans le dossier de la version de la base et rattaché à celle-ci
+   par son build_id : un index construit pour une autre version de la base est ignoré au chargement.
+
+   Auteur : Cyril Bouvart
+'''
+
+INDEX_META_FILE = "index.json"
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+IVF_OFFSETS_FILE = "ivf_offsets.npy"
+IVF_IDS_FILE = "ivf_ids.npy"
+HNSW_FILE = "hnsw.bin"
+INDEX_FILES = (INDEX_META_FILE, IVF_CENTROIDS_FILE, IVF_OFFSETS_FILE, IVF_IDS_FILE, HNSW_FILE)  # Métadonnées en premier
+
+# Valeurs par défaut des compromis rappel / latence
+DEFAULT_NPROBE = 8
+DEFAULT_EF = 64
+
+active_log = True # Activer/désactiver l'affichage des logs
+
+def log(message):
+    if active_log:
+        print(message)
+
+def _store_build_id(store):
+    return store.meta.get("build_id")
+
+def _write_index_meta(directory, meta):
+    tmp_path = os.path.join(directory, INDEX_META_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(directory, INDEX_META_FILE))
+
+# Lecture d'un bloc de la base en float32 normalisé
+def _normalized_rows(store, indices_or_slice):
+    rows = np.asarray(store.embeddings[indices_or_slice], dtype=np.float32)
+    if store.norms is not None:
+        rows = rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+    return rows
+
+# Affectation de chaque ligne au centre le plus proche (produit scalaire maximal)
+def _assign(rows, centroids):
+    return np.argmax(rows @ centroids.T, axis=1)
+
+# Index IVF en NumPy pur
+class IVFIndex:
+    def __init__(self, store, centroids, offsets, ids, nprobe=DEFAULT_NPROBE, scorer=None):
+        self.store = store
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.nprobe = nprobe
+        self.scorer = scorer or store  # Calcul des scores des candidats (exact ou quantifié)
+
+    # Construction : k-means sphérique sur un échantillon puis affectation de toute la base par blocs
+    @classmethod
+    def build(cls, store, nlist=None, iterations=10, sample_size=65536, seed=0):
+        count = len(store)
+        nlist = nlist or max(1, int(4 * np.sqrt(count)))
+        nlist = min(nlist, count)
+        rng = np.random.default_rng(seed)
+
+        sample_ids = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = _normalized_rows(store, sample_ids)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            sums, counts = group_sums(sample, _assign(sample, centroids), nlist)
+            empty = counts == 0
+            sums[empty] = centroids[empty]  # Un groupe vide garde son centre
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+        assignment = np.empty(count, dtype=np.int32)
+        for start in range(0, count, SEARCH_BLOCK_SIZE):
+            rows = _normalized_rows(store, slice(start, start + SEARCH_BLOCK_SIZE))
+            assignment[start:start + len(rows)] = _assign(rows, centroids)
+
+        ids = np.argsort(assignment, kind="stable").astype(np.int64)  # Indices triés à l'intérieur de chaque liste
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+        return cls(store, centroids.astype(np.float32), offsets, ids)
+
+    def save(self, directory):
+        # Fichiers écrits d'un coup (fichiers temporaires), dans le dossier d'une version non publiée
+        save_npy(os.path.join(directory, IVF_CENTROIDS_FILE), self.centroids)
+        save_npy(os.path.join(directory, IVF_OFFSETS_FILE), self.offsets)
+        save_npy(os.path.join(directory, IVF_IDS_FILE), self.ids)
+        _write_index_meta(directory, {
+            "type": "ivf",
+            "store_build_id": _store_build_id(self.store),
+            "nlist": int(len(self.centroids)),
+        })
+
+    @classmethod
+    def load(cls, store, directory, nprobe=DEFAULT_NPROBE, scorer=None):
+        return cls(
+            store,
+            np.load(os.path.join(directory, IVF_CENTROIDS_FILE)),
+            np.load(os.path.join(directory, IVF_OFFSETS_FILE)),
+            np.load(os.path.join(directory, IVF_IDS_FILE), mmap_mode="r"),
+            nprobe=nprobe,
+            scorer=scorer,
+        )
+
+    def search(self, query, k):
+        query = normalize(query)
+        nprobe = min(self.nprobe, len(self.centroids))
+        lists, _ = top_k(np.arange(len(self.centroids)), self.centroids @ query, nprobe, ordered=False)
+        candidates = np.sort(np.concatenate([self.ids[self.offsets[i]:self.offsets[i + 1]] for i in lists]))
+        return self.scorer.search_rows(candidates, query, k)
+
+# Index HNSW (hnswlib)
+class HNSWIndex:
+    def __init__(self, store, index, ef=DEFAULT_EF):
+        self.store = store
+        self.index = index
+        self.ef = ef
+        self.index.set_ef(ef)
+
+    @classmethod
+    def build(cls, store, m=16, ef_construction=200):
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=store.embeddings.shape[1])
+        index.init_index(max_elements=len(store), ef_construction=ef_construction, M=m)
+        for start in range(0, len(store), SEARCH_BLOCK_SIZE):
+            rows = _normalized_rows(store, slice(start, start + SEARCH_BLOCK_SIZE))
+            index.add_items(rows, np.arange(start, start + len(rows)))
+        return cls(store, index)
+
+    def save(self, directory):
+        tmp_path = os.path.join(directory, HNSW_FILE + ".tmp")
+        self.index.save_index(tmp_path)
+        os.replace(tmp_path, os.path.join(directory, HNSW_FILE))
+        _write_index_meta(directory, {
+            "type": "hnsw",
+            "store_build_id": _store_build_id(self.store),
+        })
+
+    @classmethod
+    def load(cls, store, directory, ef=DEFAULT_EF):
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=store.embeddings.shape[1])
+        index.load_index(os.path.join(directory, HNSW_FILE), max_elements=len(store))
+        return cls(store, index, ef=ef)
+
+    def search(self, query, k):
+        self.index.set_ef(max(self.ef, k))
+        labels, distances = self.index.knn_query(normalize(query), k=min(k, len(self.store)))
+        return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+# Construction et sauvegarde de l'index du type demandé ("ivf" ou "hnsw"), par défaut dans le dossier de la base
+def build_index(store, index_type, directory=None):
+    directory = store.directory if directory is None else directory
+    start = time.perf_counter()
+    if index_type == "ivf":
+        index = IVFIndex.build(store)
+    elif index_type == "hnsw":
+        index = HNSWIndex.build(store)
+    else:
+        raise ValueError(f"Type d'index inconnu : {index_type}")
+    index.save(directory)
+    log(f"  🧭 Index {index_type} construit en {time.perf_counter() - start:.1f}s")
+    return index
+
+# Chargement de l'index de la base, None si absent, obsolète ou si la base est trop petite
+def load_index(store, directory=None, min_size=0, nprobe=DEFAULT_NPROBE, ef=DEFAULT_EF, scorer=None):
+    directory = store.directory if directory is None else directory
+    meta_path = os.path.join(directory, INDEX_META_FILE)
+    if len(store) < min_size or not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("store_build_id") != _store_build_id(store):
+        log("⚠️ Index ANN obsolète, recherche exacte utilisée (relancez generateStore).")
+        return None
+
+    if meta["type"] == "ivf":
+        return IVFIndex.load(store, directory, nprobe=nprobe, scorer=scorer)
+    if meta["type"] == "hnsw":
+        try:
+            return HNSWIndex.load(store, directory, ef=ef)
+        except ImportError:
+            log("⚠️ hnswlib n'est pas installé, recherche exacte utilisée.")
+            return None
+    return None
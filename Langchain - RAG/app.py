@@ -1,9 +1,13 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+import json
 import threading
 import time
 import uuid
 
-from launchRag import startRag
+import launchRag
+from launchRag import startRag, rag_stats, rag_metrics
+from caches import normalize_question
+from workerPool import WorkerPool, QueueFull, SingleFlight, RequestEvents
 
 '''
    API Flask permettant d'interroger le RAG.
@@ -19,14 +23,23 @@ app = Flask(__name__)
 pending_requests = {}
 EXPIRATION_TIME = 300  # 5 minutes en secondes
 
+# Pool de traitement : nombre de questions traitées en même temps et taille de la file d'attente
+WORKERS = 2
+MAX_QUEUE = 32
+MAX_QUEUED_PER_CLIENT = 4  # Questions en attente par client_id (au-delà : 429), None pour aucune limite
+
+# Attente de la réponse : durée maximale d'un long-poll (/status?wait=) et intervalle des messages de maintien SSE (/events)
+MAX_LONG_POLL = 60
+SSE_KEEPALIVE = 15
+
 # Fonction de nettoyage des requêtes expirées
 def cleanup_old_requests():
     while True:
         current_time = time.time()
         expired_ids = [
             question_id
-            for question_id, data in pending_requests.items()
-            if current_time - data["timestamp"] > EXPIRATION_TIME
+            for question_id, data in list(pending_requests.items())
+            if data["status"] != "pending" and current_time - data["timestamp"] > EXPIRATION_TIME
         ]
         
         for question_id in expired_ids:
@@ -39,9 +52,21 @@ def cleanup_old_requests():
 cleanup_thread = threading.Thread(target=cleanup_old_requests, daemon=True)
 cleanup_thread.start()
 
-# Traitement de la question en arrière-plan
+# Questions identiques (après normalisation) en cours : un seul appel au RAG pour toutes
+single_flight = SingleFlight(metrics=launchRag.tracer.metrics)
+launchRag.stats_sources["coalescing"] = single_flight.stats
+
+# Enregistre le résultat d'une question et réveille les clients qui l'attendent (long-poll, SSE)
+def complete_request(question_id, status, response):
+    # Le délai d'expiration court à partir de la fin du traitement
+    pending_requests[question_id].update(status=status, response=response, timestamp=time.time())
+    pending_requests[question_id]["done"].set()
+    pending_requests[question_id]["events"].close()
+
+# Traitement de la question en arrière-plan, résultat transmis à toutes les questions identiques rattachées
 def process_question(question_id, question):
     print(f"📩 Traitement en arrière-plan : {question}")
+    status, response = "error", "Erreur serveur"
 
     try:
         # Appel du RAG
@@ -53,18 +78,28 @@ def process_question(question_id, question):
             question_rewriter=question_rewriter,
             hallucination_grader=hallucination_grader,
             answer_grader=answer_grader,
+            on_event=pending_requests[question_id]["events"].publish,
         )
 
         print(f"✅ Réponse générée pour {question_id}: {response}")
-
-        # Stocke la réponse
-        pending_requests[question_id]["response"] = response
-        pending_requests[question_id]["status"] = "completed"
+        status = "completed"
 
     except Exception as e:
         print(f"❌ Erreur : {e}")
-        pending_requests[question_id]["response"] = "Erreur serveur"
-        pending_requests[question_id]["status"] = "error"
+
+    # Stocke la réponse pour toutes les questions rattachées
+    for waiting_id in single_flight.finish(normalize_question(question)) or [question_id]:
+        complete_request(waiting_id, status, response)
+
+# Pool de threads de taille fixe et file d'attente bornée
+worker_pool = WorkerPool(
+    process_question,
+    workers=WORKERS,
+    max_queue=MAX_QUEUE,
+    max_per_client=MAX_QUEUED_PER_CLIENT,
+    metrics=launchRag.tracer.metrics,
+)
+launchRag.stats_sources["queue"] = worker_pool.stats
 
 # Définition de la route Flask
 @app.route('/ask', methods=['POST'])
@@ -83,31 +118,116 @@ def ask():
     pending_requests[question_id] = {
         "status": "pending",
         "response": None,
-        "timestamp": time.time()
+        "timestamp": time.time(),
+        "done": threading.Event(),  # Signalé à la fin du traitement
+        "events": RequestEvents(),  # Tokens de la réponse et verdicts, pour /events?stream=1
     }
 
-    print(f"📩 Question reçue (ID: {question_id})")
-
-    # Lancer le traitement en arrière-plan
-    thread = threading.Thread(target=process_question, args=(question_id, question))
-    thread.start()
-
-    return jsonify({"question_id": question_id, "status": "pending"}), 202
+    # Question identique déjà en cours : rattachement à son traitement et à ses événements (transmis par single_flight,
+    # la question qui l'a lancé peut avoir déjà été refusée et supprimée, ses événements sont alors clos)
+    key = normalize_question(question)
+    leader_id, events = single_flight.join(key, question_id, pending_requests[question_id]["events"])
+    if leader_id is not None:
+        pending_requests[question_id]["leader"] = leader_id
+        pending_requests[question_id]["events"] = events
+        position = worker_pool.position(leader_id)
+        print(f"🔗 Question reçue (ID: {question_id}), rattachée au traitement de {leader_id}")
+        return jsonify({"question_id": question_id, "status": "pending", "position": position}), 202
+
+    # Mise en file du traitement : 503 si la file est pleine, 429 si le client a déjà trop de questions en attente
+    try:
+        position = worker_pool.submit(question_id, question, client_id=client_id)
+    except QueueFull as e:
+        # Les questions rattachées entre-temps sont refusées avec celle-ci
+        for waiting_id in single_flight.finish(key):
+            complete_request(waiting_id, "error", str(e))
+        del pending_requests[question_id]
+        print(f"⛔ Question refusée ({e.reason}), réessayer dans {e.retry_after}s")
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429 if e.reason == "client" else 503
+
+    print(f"📩 Question reçue (ID: {question_id}, position {position})")
+
+    return jsonify({"question_id": question_id, "status": "pending", "position": position}), 202
+
+# État d'une question : (contenu, code HTTP)
+def request_status(question_id, status_data):
+    if status_data["status"] == "completed":
+        return {"status": "completed", "response": status_data["response"]}, 200
+    elif status_data["status"] == "error":
+        return {"status": "error", "response": status_data["response"]}, 500
+    else:
+        # Position dans la file d'attente, 0 si la question est en cours de traitement
+        position = worker_pool.position(status_data.get("leader", question_id))
+        return {"status": "pending", "position": position}, 202
 
 # Route HTTP pour vérifier l'état de la question
+# Avec ?wait=<secondes> (long-poll), la réponse n'est renvoyée qu'à la fin du traitement ou après ce délai
 @app.route('/status/<question_id>', methods=['GET'])
 def get_status(question_id):
     if question_id not in pending_requests:
         return jsonify({"error": "Question ID inconnu"}), 404
 
     status_data = pending_requests[question_id]
+    wait = request.args.get("wait", 0, type=float)
+    if wait > 0:
+        status_data["done"].wait(min(wait, MAX_LONG_POLL))
+
+    payload, code = request_status(question_id, status_data)
+    return jsonify(payload), code
+
+# Message Server-Sent Events
+def sse_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Route HTTP Server-Sent Events : position dans la file (vérifiée à chaque message de maintien), puis le résultat dès la
+# fin du traitement. Avec ?stream=1, les tokens de chaque réponse générée sont envoyés au fil de la génération
+# (événements token), suivis du verdict de la vérification (événement validation : une réponse rejetée est à retirer,
+# celle de la tentative suivante arrive ensuite)
+@app.route('/events/<question_id>', methods=['GET'])
+def get_events(question_id):
+    if question_id not in pending_requests:
+        return jsonify({"error": "Question ID inconnu"}), 404
 
-    if status_data["status"] == "completed":
-        return jsonify({"status": "completed", "response": status_data["response"]}), 200
-    elif status_data["status"] == "error":
-        return jsonify({"status": "error", "response": status_data["response"]}), 500
-    else:
-        return jsonify({"status": "pending"}), 202
+    status_data = pending_requests[question_id]
+    stream = request.args.get("stream", 0, type=int) == 1
+
+    def events():
+        position, sent = None, 0
+        while True:
+            payload, _ = request_status(question_id, status_data)
+            if payload["status"] == "pending" and payload["position"] != position:
+                position = payload["position"]
+                yield sse_event("pending", payload)
+            # En streaming, la boucle ne s'arrête qu'une fois tous les événements envoyés (verdict final compris)
+            if stream:
+                new_events, closed = status_data["events"].wait(sent, SSE_KEEPALIVE)
+                for name, data in new_events:
+                    yield sse_event(name, data)
+                sent += len(new_events)
+                if closed:
+                    break
+                if new_events:
+                    continue
+            elif status_data["done"].wait(SSE_KEEPALIVE):
+                break
+            yield ": keep-alive\n\n"
+        payload, _ = request_status(question_id, status_data)
+        yield sse_event("result", payload)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+
+# Route HTTP des statistiques du RAG (caches, file d'attente Ollama)
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify(rag_stats()), 200
+
+# Route HTTP des métriques au format Prometheus (durée des étapes, tentatives, tokens, caches)
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(rag_metrics(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == '__main__':
     app.run(host='localhost', port=5000, debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,98 @@
+import numpy as np
+
+import sys
+import time
+
+from vectorStore import STORE_DIR, StoreReader
+from annIndex import IVFIndex, HNSWIndex, load_index
+from quantization import load_quantization
+
+'''
+   Mesure du rappel et de la latence de l'index approximatif et des embeddings quantifiés par rapport à la recherche exacte.
+
+   Utilisation :
+       python benchmarkAnn.py                  (questions simulées à partir des chunks de la base)
+       python benchmarkAnn.py questions.txt    (une question par ligne, encodée avec SentenceTransformer)
+
+   Pour chaque valeur de nprobe (IVF) ou ef (HNSW), le script affiche le rappel@k moyen (part des k résultats exacts
+   retrouvés par l'index) et la latence moyenne / p95 par requête. Si la base est quantifiée (QUANTIZATION dans generateStore),
+   la recherche sur les codes est mesurée avec et sans re-classement exact (RERANK_VALUES).
+'''
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+QUERY_COUNT = 200
+K_VALUES = [1, 4, 10]
+NPROBE_VALUES = [1, 2, 4, 8, 16, 32]
+EF_VALUES = [16, 32, 64, 128, 256]
+RERANK_VALUES = [0, 2, 4, 8]
+
+# Questions simulées : chunks tirés au hasard et légèrement bruités
+def sample_queries(store, count, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.sort(rng.choice(len(store), size=min(count, len(store)), replace=False))
+    queries = np.asarray(store.embeddings[ids], dtype=np.float32)
+    return queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+
+def encode_questions(path):
+    from sentence_transformers import SentenceTransformer
+
+    with open(path, "r", encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+    return SentenceTransformer(EMBEDDING_MODEL).encode(questions)
+
+def run(searcher, queries, k):
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids, _ = searcher.search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids)
+    return results, np.array(latencies)
+
+def report(label, results, exact, latencies, k):
+    recall = np.mean([len(set(r[:k].tolist()) & set(e[:k].tolist())) / min(k, len(e)) for r, e in zip(results, exact)])
+    print(f"  {label:<14} k={k:<3} rappel@k={recall:.3f}  latence moy={latencies.mean():.2f}ms  p95={np.percentile(latencies, 95):.2f}ms")
+
+def main():
+    store = StoreReader(STORE_DIR)
+    queries = encode_questions(sys.argv[1]) if len(sys.argv) > 1 else sample_queries(store, QUERY_COUNT)
+    print(f"📊 {len(store)} chunks, {len(queries)} requêtes")
+
+    # Index de la base s'il existe, sinon construit en mémoire
+    index = load_index(store)
+    indexes = []
+    if isinstance(index, IVFIndex):
+        indexes.append(("ivf", index))
+    elif isinstance(index, HNSWIndex):
+        indexes.append(("hnsw", index))
+    else:
+        print("🔄 Construction d'un index IVF en mémoire...")
+        indexes.append(("ivf", IVFIndex.build(store)))
+
+    quantized = load_quantization(store)
+    if quantized is not None:
+        print(f"🗜️ Embeddings quantifiés : {quantized.quantizer.kind}")
+
+    for k in K_VALUES:
+        exact, latencies = run(store, queries, k)
+        print(f"\nk={k}")
+        report("exact", exact, exact, latencies, k)
+        for name, index in indexes:
+            if name == "ivf":
+                for nprobe in NPROBE_VALUES:
+                    index.nprobe = nprobe
+                    results, latencies = run(index, queries, k)
+                    report(f"ivf nprobe={nprobe}", results, exact, latencies, k)
+            else:
+                for ef in EF_VALUES:
+                    index.ef = ef
+                    results, latencies = run(index, queries, k)
+                    report(f"hnsw ef={ef}", results, exact, latencies, k)
+        if quantized is not None:
+            for rerank in RERANK_VALUES:
+                quantized.rerank = rerank
+                results, latencies = run(quantized, queries, k)
+                report(f"{quantized.quantizer.kind} rerank={rerank}", results, exact, latencies, k)
+
+if __name__ == '__main__':
+    main()
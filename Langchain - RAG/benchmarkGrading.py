@@ -0,0 +1,60 @@
+import numpy as np
+
+import sys
+import time
+
+import launchRag
+from launchRag import startRag, retrieve, grade_documents
+
+'''
+   Comparaison des modes de filtrage des documents récupérés (GRADING_MODE dans launchRag).
+
+   Utilisation :
+       python benchmarkGrading.py                  (questions par défaut)
+       python benchmarkGrading.py questions.txt    (une question par ligne)
+
+   Pour chaque question, les documents sont récupérés une fois puis notés par chaque mode. Le script affiche la
+   latence moyenne / p95 du filtrage et l'accord avec le mode "serial" (part des documents ayant le même verdict).
+'''
+
+MODES = ["serial", "batch", "concurrent"]
+QUESTIONS = [
+    "Quelles sont les interfaces de la paie ?",
+    "Comment corriger une erreur de flux ?",
+    "Qui contacter en cas d'incident sur une interface ?",
+]
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = QUESTIONS
+
+    launchRag.active_log = False
+    # Sans cache des réponses : les modes suivants relèveraient les notations (question, chunk) du mode "serial"
+    launchRag.LLM_CACHE_CHAINS = {name: False for name in launchRag.LLM_CACHE_CHAINS}
+    rag_pipeline, retriever, _, retrieval_grader, *_ = startRag()
+    batch_grader = rag_pipeline.keywords["batch_grader"]
+    print(f"📊 {len(questions)} questions, concurrence={launchRag.GRADING_CONCURRENCY}")
+
+    latencies = {mode: [] for mode in MODES}
+    agreements = {mode: [] for mode in MODES}
+    for question in questions:
+        documents = retrieve(question, retriever)
+        verdicts = {}
+        for mode in MODES:
+            start = time.perf_counter()
+            kept = grade_documents(question, documents, retrieval_grader, batch_grader, mode=mode)
+            latencies[mode].append((time.perf_counter() - start) * 1000)
+            kept_ids = {id(d) for d in kept}
+            verdicts[mode] = [id(d) in kept_ids for d in documents]
+        for mode in MODES:
+            agreements[mode].append(np.mean([a == b for a, b in zip(verdicts[mode], verdicts["serial"])]) if documents else 1.0)
+
+    for mode in MODES:
+        times = np.array(latencies[mode])
+        print(f"  {mode:<11} latence moy={times.mean():.0f}ms  p95={np.percentile(times, 95):.0f}ms  accord={np.mean(agreements[mode]):.3f}")
+
+if __name__ == '__main__':
+    main()
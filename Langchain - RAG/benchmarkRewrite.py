@@ -0,0 +1,89 @@
+import numpy as np
+
+import sys
+import time
+
+import launchRag
+from launchRag import startRag
+
+'''
+   Latence du RAG avec et sans réécriture spéculative (SPECULATIVE_REWRITE dans launchRag).
+
+   Utilisation :
+       python benchmarkRewrite.py                  (questions par défaut)
+       python benchmarkRewrite.py questions.txt    (une question par ligne, de préférence des questions mal formulées)
+
+   Les caches (réponses des LLM, réponses validées, résultats du retriever) sont désactivés pour que les deux modes
+   fassent les mêmes appels. Le script affiche la latence p50 / p95 de chaque mode, pour toutes les questions et pour
+   celles qui ont nécessité une reformulation (mesurées sans spéculation).
+'''
+
+REPEATS = 3
+QUESTIONS = [
+    "interfaces paie ?",
+    "erreur flux quoi faire",
+    "contact incident",
+]
+
+# Reformulateur comptant ses appels, pour repérer les questions reformulées
+class CountingRewriter:
+    def __init__(self, question_rewriter):
+        self.question_rewriter = question_rewriter
+        self.calls = 0
+
+    def invoke(self, inputs):
+        self.calls += 1
+        return self.question_rewriter.invoke(inputs)
+
+    async def ainvoke(self, inputs):
+        self.calls += 1
+        return await self.question_rewriter.ainvoke(inputs)
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = QUESTIONS
+
+    launchRag.active_log = False
+    launchRag.LLM_CACHE_CHAINS = {name: False for name in launchRag.LLM_CACHE_CHAINS}
+    rag_pipeline, retriever, rag_chain, retrieval_grader, question_rewriter, hallucination_grader, answer_grader = startRag()
+    print(f"📊 {len(questions)} questions x {REPEATS}")
+
+    latencies = {False: [], True: []}
+    rewritten = []
+    for _ in range(REPEATS):
+        for question in questions:
+            for speculative in (False, True):
+                for cache in (retriever.query_cache, retriever.result_cache):
+                    if cache is not None:
+                        cache.clear()
+                rewriter = CountingRewriter(question_rewriter)
+                start = time.perf_counter()
+                rag_pipeline(
+                    question,
+                    retriever=retriever,
+                    rag_chain=rag_chain,
+                    retrieval_grader=retrieval_grader,
+                    question_rewriter=rewriter,
+                    hallucination_grader=hallucination_grader,
+                    answer_grader=answer_grader,
+                    answer_cache=None,
+                    speculative=speculative,
+                )
+                latencies[speculative].append((time.perf_counter() - start) * 1000)
+                if not speculative:
+                    rewritten.append(rewriter.calls > 0)
+
+    rewritten = np.array(rewritten)
+    for speculative, label in ((False, "sans spéculation"), (True, "spéculative")):
+        times = np.array(latencies[speculative])
+        line = f"  {label:<17} toutes : p50={np.percentile(times, 50):.0f}ms p95={np.percentile(times, 95):.0f}ms"
+        if rewritten.any():
+            times = times[rewritten]
+            line += f"  |  reformulées ({len(times)}) : p50={np.percentile(times, 50):.0f}ms p95={np.percentile(times, 95):.0f}ms"
+        print(line)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import numpy as np
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+'''
+   Caches en mémoire du RAG : LRU borné en taille avec durée de vie optionnelle et compteurs de succès / échecs.
+
+   Le cache sémantique conserve les réponses validées avec l'embedding de la question et les hashes des chunks
+   utilisés : une question proche (similarité cosinus au-dessus du seuil) reçoit la même réponse sans appel au LLM, à
+   condition de citer les mêmes identifiants (ERR-404 et ERR-405 sont très proches pour le modèle d'embedding).
+   Il est vidé dès que la base est reconstruite (build_id différent).
+
+   Auteur : Cyril Bouvart
+'''
+
+# Normalisation d'une question pour les clés de cache : casse, espaces et ponctuation finale
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip(" ?!.")
+
+class LRUCache:
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl  # Durée de vie d'une entrée en secondes, None pour aucune limite
+        self.entries = OrderedDict()  # Clé -> (date d'ajout, valeur)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+class SemanticCache:
+    def __init__(self, max_size=1024, threshold=0.95, ttl=None):
+        self.max_size = max_size
+        self.threshold = threshold  # Similarité cosinus minimale entre deux questions
+        self.ttl = ttl  # Durée de vie d'une entrée en secondes, None pour aucune limite
+        self.vectors = None  # (max_size, dimension) : embeddings normalisés des questions
+        self.used = np.zeros(max_size, dtype=bool)
+        self.entries = OrderedDict()  # Ligne de vectors -> (date d'ajout, réponse, hashes des chunks sources, identifiants)
+        self.build_id = None  # Base pour laquelle les réponses ont été validées
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_build(self, build_id):
+        if build_id != self.build_id:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.used[:] = False
+            self.build_id = build_id
+
+    # Ligne de la question en cache la plus proche au-dessus du seuil, avec les mêmes identifiants, None si aucune
+    def _nearest(self, vector, identifiers):
+        if not self.entries:
+            return None
+        scores = self.vectors @ vector
+        scores[~self.used] = -np.inf
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for slot in candidates[np.argsort(-scores[candidates])]:
+            if self.entries[int(slot)][3] == identifiers:
+                return int(slot)
+        return None
+
+    def _remove(self, slot):
+        del self.entries[slot]
+        self.used[slot] = False
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    # Réponse validée pour une question proche citant les mêmes identifiants (lexicalIndex.identifier_terms), default
+    # si aucune
+    def get(self, embedding, build_id, default=None, identifiers=frozenset()):
+        vector = self._normalize(embedding)
+        with self.lock:
+            self._check_build(build_id)
+            slot = self._nearest(vector, frozenset(identifiers))
+            if slot is not None:
+                created, answer, _, _ = self.entries[slot]
+                if self.ttl is None or time.time() - created <= self.ttl:
+                    self.entries.move_to_end(slot)
+                    self.hits += 1
+                    return answer
+                self._remove(slot)
+            self.misses += 1
+            return default
+
+    def put(self, embedding, answer, sources, build_id, identifiers=frozenset()):
+        identifiers = frozenset(identifiers)
+        vector = self._normalize(embedding)
+        with self.lock:
+            self._check_build(build_id)
+            if self.vectors is None or self.vectors.shape[1] != len(vector):
+                self.vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self.entries.clear()
+                self.used[:] = False
+
+            # Une question quasi identique (mêmes identifiants) remplace l'entrée existante
+            slot = self._nearest(vector, identifiers)
+            if slot is None:
+                if len(self.entries) >= self.max_size:
+                    slot, _ = self.entries.popitem(last=False)
+                    self.used[slot] = False
+                    self.evictions += 1
+                slot = int(np.argmin(self.used))
+
+            self.vectors[slot] = vector
+            self.used[slot] = True
+            self.entries[slot] = (time.time(), answer, tuple(sources), identifiers)
+            self.entries.move_to_end(slot)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used[:] = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,80 @@
+import numpy as np
+
+import sys
+
+import launchRag
+from launchRag import startRag, retrieve, grade_documents
+from relevanceFilter import RelevanceFilter
+
+'''
+   Calibration des seuils du pré-filtre de pertinence (PREFILTER_* dans launchRag).
+
+   Utilisation :
+       python calibrateFilter.py                  (questions par défaut)
+       python calibrateFilter.py questions.txt    (une question par ligne)
+
+   Chaque document récupéré est noté une fois par le retrieval_grader (mode "serial", sans pré-filtre), qui sert de
+   référence. Pour chaque couple de seuils (accept, reject), le script affiche la part des appels au LLM évités (documents
+   tranchés par le pré-filtre) et le taux de désaccord avec le LLM parmi les documents tranchés et sur l'ensemble.
+   Si PREFILTER_CROSS_ENCODER est renseigné, la même grille est appliquée aux scores du cross-encoder.
+'''
+
+SIMILARITY_THRESHOLDS = [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8]
+CROSS_ENCODER_THRESHOLDS = [-6.0, -4.0, -2.0, 0.0, 2.0, 4.0, 6.0]
+QUESTIONS = [
+    "Quelles sont les interfaces de la paie ?",
+    "Comment corriger une erreur de flux ?",
+    "Qui contacter en cas d'incident sur une interface ?",
+]
+
+# Appels évités et désaccords pour chaque couple (accept, reject) avec reject < accept.
+# Les documents de lexical (trouvés par BM25) ne sont jamais écartés, comme dans RelevanceFilter.
+def report(title, scores, labels, thresholds, lexical=None):
+    lexical = lexical or [False] * len(scores)
+    print(f"\n{title}")
+    print(f"  {'accept':>7} {'reject':>7} {'évités':>7} {'désaccord tranchés':>19} {'désaccord total':>16}")
+    for accept in thresholds:
+        for reject in [None] + [t for t in thresholds if t < accept]:
+            verdicts = [
+                RelevanceFilter._threshold_verdict(score, accept, None if protected else reject)
+                for score, protected in zip(scores, lexical)
+            ]
+            decided = [(verdict == "oui", label) for verdict, label in zip(verdicts, labels) if verdict is not None]
+            saved = len(decided) / len(scores)
+            errors = sum(predicted != label for predicted, label in decided)
+            disagreement = errors / len(decided) if decided else 0.0
+            reject_label = "-" if reject is None else f"{reject:.2f}"
+            print(f"  {accept:>7.2f} {reject_label:>7} {saved:>7.1%} {disagreement:>19.1%} {errors / len(scores):>16.1%}")
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = QUESTIONS
+
+    launchRag.active_log = False
+    _, retriever, _, retrieval_grader, *_ = startRag()
+
+    similarities, lexical, cross_scores, labels = [], [], [], []
+    relevance_filter = RelevanceFilter(cross_encoder=launchRag.PREFILTER_CROSS_ENCODER)
+    for question in questions:
+        documents = retrieve(question, retriever)
+        kept = grade_documents(question, documents, retrieval_grader, mode="serial")
+        kept_ids = {id(d) for d in kept}
+        labels.extend(id(d) in kept_ids for d in documents)
+        similarities.extend(d.metadata.get("similarity") for d in documents)
+        lexical.extend(bool(d.metadata.get("lexical")) for d in documents)
+        if relevance_filter.cross_encoder:
+            cross_scores.extend(relevance_filter.cross_scores(question, documents).tolist())
+
+    if not labels:
+        print("⚠️ Aucun document récupéré.")
+        return
+    print(f"📊 {len(questions)} questions, {len(labels)} documents, {np.mean(labels):.1%} jugés pertinents par le LLM")
+    report("Similarité cosinus", similarities, labels, SIMILARITY_THRESHOLDS, lexical)
+    if cross_scores:
+        report(f"Cross-encoder {relevance_filter.cross_encoder}", cross_scores, labels, CROSS_ENCODER_THRESHOLDS)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import os
+
+import tiktoken
+
+'''
+   Construction du contexte des prompts de génération et de vérification à partir des documents retenus.
+
+   Seul le texte des chunks est inséré, précédé d'une courte référence à sa source (fichier, page ou ligne) : les
+   métadonnées et la représentation des objets Document ne sont plus envoyées au LLM. Les chunks consécutifs d'un même
+   fichier, qui se recouvrent de CHUNK_OVERLAP tokens (generateStore), sont fusionnés sans répéter la partie commune.
+   Le contexte est limité à un budget de tokens, mesuré avec l'encodage tiktoken du découpage des documents.
+
+   Auteur : Cyril Bouvart
+'''
+
+# Encodage tiktoken utilisé par RecursiveCharacterTextSplitter.from_tiktoken_encoder dans generateStore
+CONTEXT_ENCODING = "gpt2"
+
+# Recouvrement minimal (en caractères) pour fusionner deux chunks
+MIN_OVERLAP = 20
+
+# Budget minimal (en tokens) pour insérer un bloc tronqué plutôt que de l'abandonner
+MIN_TRUNCATED_TOKENS = 32
+
+_encoding = None
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(CONTEXT_ENCODING)
+    return _encoding
+
+def count_tokens(text):
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+# Référence courte de la source d'un chunk : « fichier.pdf p.3 », « fichier.csv l.12 »
+def source_tag(metadata):
+    tag = os.path.basename(str(metadata.get("source", ""))) or "document"
+    if metadata.get("page") is not None:
+        tag += f" p.{int(metadata['page']) + 1}"
+    elif metadata.get("row") is not None:
+        tag += f" l.{int(metadata['row']) + 1}"
+    return tag
+
+# Longueur du plus long suffixe de first qui est aussi un préfixe de second, 0 si inférieure à MIN_OVERLAP
+def _overlap(first, second):
+    for size in range(min(len(first), len(second)), MIN_OVERLAP - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+# Blocs [tag, texte] dans l'ordre des documents : doublons et chunks recouvrants d'un même fichier fusionnés
+def merge_chunks(documents):
+    blocks = []
+    for document in documents:
+        text = document.page_content.strip()
+        source = document.metadata.get("source")
+        for block in blocks:
+            if block[0] != source:
+                continue
+            if text in block[2]:
+                break
+            if block[2] in text:
+                block[2] = text
+                break
+            size = _overlap(block[2], text)
+            if size:
+                block[2] += text[size:]
+                break
+            size = _overlap(text, block[2])
+            if size:
+                block[1] = source_tag(document.metadata)
+                block[2] = text + block[2][size:]
+                break
+        else:
+            blocks.append([source, source_tag(document.metadata), text])
+    return [(tag, text) for _, tag, text in blocks]
+
+# Contexte du prompt limité à max_tokens : (texte, statistiques)
+def pack_context(documents, max_tokens=2048):
+    encoding = get_encoding()
+    blocks = merge_chunks(documents)
+    parts, used, truncated, dropped = [], 0, 0, 0
+    for tag, text in blocks:
+        block = f"[{tag}] {text}"
+        tokens = encoding.encode(block, disallowed_special=())
+        separator = 1 if parts else 0  # "\n\n"
+        remaining = max_tokens - used - separator
+        if len(tokens) > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                dropped += 1
+                continue
+            block = encoding.decode(tokens[:remaining])
+            tokens = tokens[:remaining]
+            truncated += 1
+        parts.append(block)
+        used += len(tokens) + separator
+
+    stats = {
+        "documents": len(documents),
+        "blocks": len(blocks),
+        "tokens": used,
+        "truncated": truncated,
+        "dropped": dropped,
+    }
+    return "\n\n".join(parts), stats
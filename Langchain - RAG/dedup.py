@@ -0,0 +1,131 @@
+import numpy as np
+
+import re
+import hashlib
+import tempfile
+import zlib
+
+from lexicalIndex import identifier_terms
+
+'''
+   Élimination des chunks dupliqués avant le calcul des embeddings.
+
+   Deux niveaux de détection :
+       - doublons exacts : hash du texte normalisé (minuscules, espaces réduits)
+       - quasi-doublons  : signature MinHash des trigrammes de mots et index LSH par bandes. Deux chunks sont fusionnés
+                           si leur similarité de Jaccard estimée atteint le seuil choisi et qu'ils citent les mêmes
+                           identifiants (lexicalIndex.identifier_terms) : deux lignes CSV qui ne diffèrent que par
+                           l'interface ou le code d'erreur sont conservées toutes les deux.
+
+   Le premier chunk rencontré est conservé, les métadonnées des doublons lui sont rattachées par generateStore.
+
+   Seuls les hashes (texte, bandes LSH) restent en mémoire : les signatures des chunks conservés (uint32), suivies du
+   hash de leurs identifiants, sont écrites dans un fichier temporaire, indexées par ligne, et relues pour vérifier les
+   candidats des bandes.
+
+   Auteur : Cyril Bouvart
+'''
+
+# Permutations MinHash (a * x + b) mod p, ramenées sur 32 bits
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_IDENTIFIERS_DIGEST_SIZE = 16
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+# Hash de l'ensemble des identifiants d'un texte, conservé avec sa signature
+def _identifiers_digest(text):
+    return hashlib.blake2b("\n".join(sorted(identifier_terms(text))).encode("utf-8"), digest_size=_IDENTIFIERS_DIGEST_SIZE).digest()
+
+# Trigrammes de mots hachés sur 32 bits
+def _shingles(text, size=3):
+    words = text.split(" ")
+    if len(words) < size:
+        grams = [text]
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams), dtype=np.uint64))
+
+# Choix du nombre de bandes pour que le seuil LSH (1/b)^(1/r) soit proche du seuil demandé
+def _lsh_bands(num_perm, threshold):
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+class ChunkDeduplicator:
+    def __init__(self, near_threshold=0.9, num_perm=64, seed=0):
+        self.near_threshold = near_threshold  # None pour ne détecter que les doublons exacts
+        self.num_perm = num_perm
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = _lsh_bands(num_perm, near_threshold or 1.0)
+
+        self.exact = {}  # Hash du texte -> ligne conservée
+        self.buckets = [{} for _ in range(self.bands)]  # Par bande : hash de la bande -> lignes conservées
+        # Signature MinHash et hash des identifiants de chaque ligne conservée, à la position de la ligne
+        self.signatures = tempfile.TemporaryFile()
+        self.signature_size = num_perm * np.dtype(np.uint32).itemsize
+        self.record_size = self.signature_size + _IDENTIFIERS_DIGEST_SIZE
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+
+    def _signature(self, text):
+        shingles = _shingles(text)[:, None]
+        hashed = np.bitwise_and((shingles * self.a + self.b) % _MERSENNE_PRIME, _MAX_HASH)
+        return hashed.min(axis=0).astype(np.uint32)
+
+    # (signature, hash des identifiants) d'une ligne conservée
+    def _read_signature(self, row):
+        self.signatures.seek(row * self.record_size)
+        record = self.signatures.read(self.record_size)
+        return np.frombuffer(record[:self.signature_size], dtype=np.uint32), record[self.signature_size:]
+
+    def _write_signature(self, row, signature, identifiers):
+        self.signatures.seek(row * self.record_size)
+        self.signatures.write(signature.tobytes() + identifiers)
+
+    def _band_keys(self, signature):
+        return [hash(signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    # Recherche d'un chunk déjà conservé identique ou très proche : (ligne conservée ou None, clé à enregistrer)
+    def find(self, text):
+        normalized = normalize_text(text)
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        if digest in self.exact:
+            self.exact_duplicates += 1
+            return self.exact[digest], None
+
+        if self.near_threshold is None:
+            return None, (digest, None, None, None)
+
+        signature = self._signature(normalized)
+        identifiers = _identifiers_digest(text)
+        band_keys = self._band_keys(signature)
+        candidates = set()
+        for bucket, key in zip(self.buckets, band_keys):
+            candidates.update(bucket.get(key, ()))
+        for row in sorted(candidates):
+            candidate, candidate_identifiers = self._read_signature(row)
+            if candidate_identifiers == identifiers and np.mean(candidate == signature) >= self.near_threshold:
+                self.near_duplicates += 1
+                return row, None
+        return None, (digest, signature, band_keys, identifiers)
+
+    # Enregistrement d'un chunk conservé à la ligne donnée
+    def add(self, key, row):
+        digest, signature, band_keys, identifiers = key
+        self.exact.setdefault(digest, row)
+        if signature is not None:
+            self._write_signature(row, signature, identifiers)
+            for bucket, band_key in zip(self.buckets, band_keys):
+                bucket.setdefault(band_key, []).append(row)
+
+    # Enregistrement d'un chunk déjà présent dans la base (reconstruction incrémentale)
+    def register(self, text, row):
+        _, key = self.find(text)
+        if key is not None:
+            self.add(key, row)
+
+    def close(self):
+        self.signatures.close()
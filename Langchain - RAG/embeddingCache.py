@@ -0,0 +1,92 @@
+import numpy as np
+
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+
+from vectorStore import STORE_DIR
+
+'''
+   Cache persistant des embeddings (SQLite), partagé par generateStore et launchRag.
+
+   La clé est le couple (nom du modèle, hash du texte normalisé). Une reconstruction de la base après un changement
+   des paramètres de découpage ou une modification partielle d'un document n'encode que les textes nouveaux.
+
+   Auteur : Cyril Bouvart
+'''
+
+# Chemin du cache, conservé d'une génération de la base à l'autre
+EMBEDDING_CACHE_PATH = os.path.join(STORE_DIR, "embedding_cache.sqlite")
+
+# Nombre maximal de paramètres par requête SQLite
+_SQL_BATCH = 500
+
+def text_key(text):
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+class EmbeddingCache:
+    def __init__(self, model_name, path=EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, hash)) WITHOUT ROWID"
+        )
+        self.connection.commit()
+
+    # Embeddings en cache : {clé: vecteur}
+    def _lookup(self, keys):
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self.lock:
+            for start in range(0, len(unique), _SQL_BATCH):
+                batch = unique[start:start + _SQL_BATCH]
+                rows = self.connection.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [self.model_name, *batch],
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def _store(self, keys, vectors):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in zip(keys, vectors)],
+            )
+            self.connection.commit()
+
+    # Embeddings des textes : lus dans le cache ou calculés par encode(textes manquants) puis enregistrés
+    def encode(self, texts, encode):
+        keys = [text_key(text) for text in texts]
+        found = self._lookup(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key not in found)
+        self.misses += len(missing)
+
+        if missing:
+            vectors = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            self._store(list(missing), vectors)
+            found.update(zip(missing, vectors))
+
+        return np.stack([found[key] for key in keys]) if texts else np.empty((0, 0), dtype=np.float32)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
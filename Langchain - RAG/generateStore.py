@@ -1,23 +1,43 @@
 from langchain_community.document_loaders import CSVLoader, PyMuPDFLoader, Docx2txtLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from langchain_community.vectorstores import SKLearnVectorStore
-from sentence_transformers import SentenceTransformer # https://www.sbert.net/index.html
-from langchain.embeddings.base import Embeddings
-
-from langchain_ollama import ChatOllama
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
-from langchain.schema import Document
-
 import os
-import pickle
 import json
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from vectorStore import (
+    STORE_DIR, CURRENT_FILE, STORE_FILES, StoreWriter, StoreReader, store_exists, remove_store, fork_store,
+    publish_store, remove_version_dir,
+)
+from annIndex import INDEX_FILES, build_index
+from quantization import QUANT_FILES, build_quantization
+from dedup import ChunkDeduplicator
+from embeddingCache import EmbeddingCache
+from lexicalIndex import BM25_FILES, build_bm25
 
 '''
    Cette application est un Self-RAG utilisant Mistral (Ollama), LangChain et SickitLearn en local pour traiter des documents CSV et PDF,
    générer les embeddings et intégrer un retriever pour la recherche de réponse.
 
+   La reconstruction est incrémentale : un manifeste (chemin, taille, date de modification, hash du contenu, paramètres du découpage)
+   est enregistré à côté du VectorStore. Seuls les fichiers ajoutés ou modifiés sont rechargés, découpés et encodés ;
+   les chunks des fichiers supprimés sont retirés de la base.
+
+   Les chunks sont traités en flux : chargement, découpage, encodage par lots de EMBED_BATCH_SIZE puis écriture sur disque.
+   La mémoire utilisée dépend de la taille des lots et non de la taille du corpus.
+
+   Avant l'encodage, les chunks identiques ou quasi identiques (MinHash/LSH, seuil DEDUP_THRESHOLD) ne sont encodés
+   qu'une fois : les métadonnées des doublons sont rattachées au chunk conservé.
+
+   Les embeddings sont lus dans un cache persistant (embeddingCache) : seuls les textes jamais encodés sont calculés.
+
+   La base et ses fichiers annexes (index ANN, quantification, BM25) sont écrits dans une nouvelle version, publiée
+   d'un coup une fois complète (vectorStore.publish_store) : un serveur en cours d'exécution n'en voit jamais une partie.
+
    Auteur : Cyril Bouvart
 
    Sources : https://langchain-ai.github.io/langgraph/tutorials/rag/langgraph_self_rag_local/#create-index
@@ -26,8 +46,42 @@ import json
        pip install langchain_community sentence_transformers langchain-ollama pymupdf docx2txt tiktoken pandas pyarrow
 '''
 
-# Chemin de sauvegarde du VectorStore
-PERSIST_PATH = os.path.join('./Store/', "vectorstore.pqt")
+# Manifeste des fichiers sources ayant servi à construire le VectorStore
+MANIFEST_PATH = os.path.join(STORE_DIR, "manifest.json")
+
+# Modèle d'embedding et nombre de chunks encodés puis écrits par lot
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 256
+
+# Précision des embeddings stockés : "float32" ou "float16" (deux fois moins de mémoire)
+STORE_DTYPE = "float32"
+
+# Index de recherche approximative construit après la base : None (recherche exacte), "ivf" ou "hnsw"
+ANN_INDEX = None
+
+# Quantification des embeddings pour le serveur : None, "int8" (4x moins de mémoire) ou "pq" (quantification produit)
+QUANTIZATION = None
+PQ_SUBVECTORS = 96  # Doit diviser la dimension des embeddings (384 pour all-MiniLM-L6-v2)
+
+# Index lexical BM25 pour la recherche hybride (noms d'interface, codes d'erreur)
+BM25_INDEX = True
+
+# Paramètres du découpage des documents (une modification entraîne une reconstruction complète)
+CHUNK_SIZE = 124
+CHUNK_OVERLAP = 24
+
+# Élimination des doublons avant encodage : doublons exacts si DEDUP, quasi-doublons à partir de la similarité
+# DEDUP_THRESHOLD (Jaccard estimée sur les trigrammes de mots, None pour les désactiver)
+DEDUP = True
+DEDUP_THRESHOLD = 0.9
+
+# Dossiers sources et extension associée
+CSV_FOLDER = "./Sources/CSV/"
+PDF_FOLDER = "./Sources/PDF/"  # Dossier contenant les PDF
+DOCX_FOLDER = "./Sources/DOCX/"
+
+# Nombre de processus utilisés pour le chargement et le découpage des documents
+INGEST_WORKERS = os.cpu_count() or 1
 
 active_log = True # Activer/désactiver l'affichage des logs
 
@@ -35,87 +89,350 @@ def log(message):
     if active_log:
         print(message)
 
-log("🔄 Chargement des documents")
+# Découpage d'un itérable en lots de taille fixe
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# Paramètres du découpage enregistrés dans le manifeste
+def splitter_params():
+    return {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "encoder": "tiktoken"}
+
+# Paramètres des embeddings enregistrés dans le manifeste : les vecteurs d'un autre modèle ne sont pas réutilisables
+def embedding_params():
+    return {"model": EMBEDDING_MODEL, "dtype": STORE_DTYPE}
+
+# Paramètres de la déduplication enregistrés dans le manifeste
+def dedup_params():
+    return {"enabled": DEDUP, "threshold": DEDUP_THRESHOLD if DEDUP else None}
+
+# Liste des fichiers sources (chemin, type) dans un ordre stable
+def list_sources():
+    sources = []
+    for folder, extension in ((CSV_FOLDER, ".csv"), (PDF_FOLDER, ".pdf"), (DOCX_FOLDER, ".docx")):
+        if not os.path.isdir(folder):
+            continue
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(extension):
+                sources.append(os.path.join(folder, filename))
+    return sources
+
+# Hash SHA-256 du contenu d'un fichier, lu par blocs
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-# Chargement des documents CSV
-csv_docs = []
-csv_folder = "./Sources/CSV/"
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-for filename in os.listdir(csv_folder):
-    if filename.endswith(".csv"):
-        csv_path = os.path.join(csv_folder, filename)
-        loader = CSVLoader(file_path=csv_path,
+def save_manifest(files):
+    manifest = {"splitter": splitter_params(), "embedding": embedding_params(), "dedup": dedup_params(), "files": files}
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+# Comparaison des fichiers sources avec le manifeste précédent
+def diff_sources(sources, manifest):
+    previous = {}
+    if (
+        manifest is not None
+        and manifest.get("splitter") == splitter_params()
+        and manifest.get("embedding") == embedding_params()
+        and manifest.get("dedup") == dedup_params()
+    ):
+        previous = manifest.get("files", {})
+
+    files, unchanged, changed = {}, [], []
+    for path in sources:
+        stat = os.stat(path)
+        entry = previous.get(path)
+        # Taille et date identiques : le fichier n'est pas relu
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            files[path] = entry
+            unchanged.append(path)
+            continue
+
+        content_hash = file_hash(path)
+        files[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": content_hash}
+        if entry is not None and entry["sha256"] == content_hash:
+            unchanged.append(path)  # Seule la date a changé
+        else:
+            changed.append(path)
+
+    deleted = [path for path in previous if path not in files]
+    return files, unchanged, changed, deleted
+
+# Chargement d'un fichier source avec le loader adapté
+def load_file(path):
+    if path.endswith(".csv"):
+        loader = CSVLoader(file_path=path,
             csv_args={
                 'delimiter': ';',
                 'quotechar': '"',
                 'fieldnames': ['Interface', 'Description', 'Solution']
             }
         )
-        csv_docs.extend(loader.load())
-        log(f'  🔄 Chargement du document {filename}')
-
-# Chargement des documents PDF
-pdf_docs = []
-pdf_folder = "./Sources/PDF/"  # Dossier contenant les PDF
-
-for filename in os.listdir(pdf_folder):
-    if filename.endswith(".pdf"):
-        pdf_path = os.path.join(pdf_folder, filename)
-        loader = PyMuPDFLoader(pdf_path)
-        pdf_docs.extend(loader.load())
-        log(f'  🔄 Chargement du document {filename}')
-
-# Chargement des documents Word
-docx_docs = []
-docx_folder = "./Sources/DOCX/"
-
-for filename in os.listdir(docx_folder):
-    if filename.endswith(".docx"):
-        docx_path = os.path.join(docx_folder, filename)
-        loader = Docx2txtLoader(docx_path)
-        docx_docs.extend(loader.load())
-        log(f'  🔄 Chargement du document {filename}')
-
-# Fusion de tous les documents (CSV + PDF + DOCX)
-docs = csv_docs + pdf_docs + docx_docs
-
-# Découpage des documents en truncks
-text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-    chunk_size=124, chunk_overlap=24
-)
-doc_splits = text_splitter.split_documents(docs)
-
-# Extraction du texte des documents pour stockage
-texts = [doc.page_content for doc in doc_splits]
-
-# Généreation des embeddings avec SentenceTransformer
-model = SentenceTransformer("all-MiniLM-L6-v2")
-embeddings = model.encode(texts)
-
-# Encapsulation dans la classe Embeddings pour respecter l'interface attendue
-class PrecomputedEmbeddings(Embeddings):
-    def __init__(self, precomputed_vectors):
-        self.precomputed_vectors = precomputed_vectors  # Stocke les embeddings calculés
-    
-    def embed_documents(self, texts):
-        return self.precomputed_vectors # Retourne les embeddings déjà calculés.
-    
-    def embed_query(self, text):
-        return model.encode([text])[0]  # Génère l'embedding pour une nouvelle requête et retourne un seul vecteur
-
-# Instanciation des embeddings calculés
-embedding_function = PrecomputedEmbeddings(precomputed_vectors=embeddings.tolist())
-
-# Création et stockage dans un SKLearnVectorStore
-log(f'- Génération de la base vectorielle')
-vectorstore = SKLearnVectorStore.from_texts(
-    texts=texts,
-    persist_path=PERSIST_PATH,
-    embedding=embedding_function,
-    metadatas=[doc.metadata for doc in doc_splits],
-    serializer="parquet",
-)
+    elif path.endswith(".pdf"):
+        loader = PyMuPDFLoader(path)
+    else:
+        loader = Docx2txtLoader(path)
+    log(f'  🔄 Chargement du document {os.path.basename(path)}')
+    return loader.load()
+
+# Découpeur partagé par les appels d'un même processus
+_text_splitter = None
+
+def get_text_splitter():
+    global _text_splitter
+    if _text_splitter is None:
+        _text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
+    return _text_splitter
+
+# Chargement et découpage d'un fichier (exécuté dans un processus du pool)
+def ingest_file(path):
+    return get_text_splitter().split_documents(load_file(path))
+
+# Chargement et découpage des fichiers en parallèle, les chunks sont renvoyés dans l'ordre des fichiers.
+# Au plus 2 fichiers par processus sont en cours pour borner la mémoire.
+# Le temps mesuré est celui passé dans le générateur (découpage, attente des processus), sans l'encodage des chunks
+# fait par l'appelant entre deux lectures.
+def ingest_files(paths):
+    workers = max(1, min(INGEST_WORKERS, len(paths)))
+    chunk_count = 0
+    elapsed = 0.0
+    resumed = time.perf_counter()
+
+    if workers == 1:
+        for path in paths:
+            for chunk in ingest_file(path):
+                chunk_count += 1
+                elapsed += time.perf_counter() - resumed
+                yield chunk
+                resumed = time.perf_counter()
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            remaining = iter(paths)
+            for path in islice(remaining, 2 * workers):
+                pending.append(executor.submit(ingest_file, path))
+            while pending:
+                splits = pending.popleft().result()
+                for path in islice(remaining, 1):
+                    pending.append(executor.submit(ingest_file, path))
+                for chunk in splits:
+                    chunk_count += 1
+                    elapsed += time.perf_counter() - resumed
+                    yield chunk
+                    resumed = time.perf_counter()
+
+    elapsed = max(elapsed + time.perf_counter() - resumed, 1e-9)
+    log(f"  ⏱️ {len(paths)} fichiers, {chunk_count} chunks chargés et découpés en {elapsed:.1f}s avec {workers} processus "
+        f"({len(paths) / elapsed:.1f} fichiers/s, {chunk_count / elapsed:.1f} chunks/s)")
+
+# Fichiers annexes de la base : (fichiers, métadonnées en premier ; type souhaité, None si désactivé ; construction)
+def sidecar_specs():
+    return [
+        (INDEX_FILES, ANN_INDEX, lambda store, directory: build_index(store, ANN_INDEX, directory)),
+        (QUANT_FILES, QUANTIZATION, lambda store, directory: build_quantization(store, QUANTIZATION, directory, subvectors=PQ_SUBVECTORS)),
+        (BM25_FILES, "bm25" if BM25_INDEX else None, lambda store, directory: build_bm25(store, directory)),
+    ]
+
+# Un fichier annexe est à jour s'il a été construit pour cette base avec le type souhaité
+def sidecar_current(directory, files, kind, build_id):
+    meta_path = os.path.join(directory, files[0])
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return meta.get("store_build_id") == build_id and meta.get("type", kind) == kind
+
+# Construction des fichiers annexes souhaités absents ou obsolètes, dans le dossier d'une version non publiée
+def build_sidecars(directory):
+    store = StoreReader(directory)
+    try:
+        build_id = store.meta.get("build_id")
+        for files, kind, build in sidecar_specs():
+            if kind is not None and not sidecar_current(directory, files, kind, build_id):
+                build(store, directory)
+    finally:
+        store.close()
+
+# Fichiers annexes de la version publiée ne correspondant plus à la configuration : nouvelle version reprenant la base
+# et les annexes à jour, complétée puis publiée. Une base de l'ancien format est aussi migrée vers une version.
+def update_sidecars():
+    store = StoreReader(STORE_DIR)
+    current, build_id = store.directory, store.meta.get("build_id")
+    store.close()
+
+    names, stale = list(STORE_FILES), False
+    for files, kind, _ in sidecar_specs():
+        if kind is None:
+            stale |= os.path.exists(os.path.join(current, files[0]))  # L'ancien fichier n'est plus souhaité
+        elif sidecar_current(current, files, kind, build_id):
+            names.extend(files)
+        else:
+            stale = True
+    if not stale and os.path.exists(os.path.join(STORE_DIR, CURRENT_FILE)):
+        return
+
+    version_dir = fork_store(current, names, STORE_DIR)
+    try:
+        build_sidecars(version_dir)
+        publish_store(version_dir, STORE_DIR)
+    except BaseException:
+        remove_version_dir(version_dir)
+        raise
+
+# Un fichier inchangé dont des chunks ont été fusionnés dans un chunk d'un fichier modifié ou supprimé doit être
+# rechargé : sans cela ses doublons disparaîtraient avec le chunk conservé.
+def release_duplicates(reader, unchanged, changed):
+    kept = set(unchanged)
+    rows = sorted(reader.duplicates)
+    survivor_sources = {row: chunk["metadata"].get("source") for row, chunk in zip(rows, reader.get_chunks(rows))}
+    while True:
+        released = {
+            metadata.get("source")
+            for row, metadatas in reader.duplicates.items() if survivor_sources[row] not in kept
+            for metadata in metadatas
+        } & kept
+        if not released:
+            break
+        kept -= released
+
+    reloaded = [path for path in unchanged if path not in kept]
+    if reloaded:
+        log(f"  🔁 {len(reloaded)} fichier(s) inchangé(s) rechargé(s) à cause de doublons fusionnés")
+    return [path for path in unchanged if path in kept], changed + reloaded
+
+def build_store():
+    os.makedirs(STORE_DIR, exist_ok=True)
+    if ANN_INDEX == "hnsw" and QUANTIZATION is not None:
+        # launchRag ne passe les codes quantifiés qu'à l'index IVF : hnswlib garde sa propre copie float32 des vecteurs
+        log(f"⚠️ ANN_INDEX = \"hnsw\" ignore QUANTIZATION = \"{QUANTIZATION}\" : aucune économie de mémoire "
+            f"(codes utilisés seulement sous ANN_MIN_SIZE chunks), préférez ANN_INDEX = \"ivf\"")
+
+    manifest = load_manifest()
+    if manifest is None or not store_exists(STORE_DIR):
+        manifest = None  # Pas de base exploitable : reconstruction complète
+    else:
+        store = StoreReader(STORE_DIR)
+        if store.meta.get("model") != EMBEDDING_MODEL or str(store.meta.get("dtype")) != STORE_DTYPE:
+            log(f"🔄 Modèle d'embedding ou type modifié ({store.meta.get('model')}, {store.meta.get('dtype')}) : reconstruction complète")
+            manifest = None
+        store.close()
+
+    sources = list_sources()
+    files, unchanged, changed, deleted = diff_sources(sources, manifest)
+
+    log(f"🔄 Fichiers : {len(changed)} ajouté(s)/modifié(s), {len(deleted)} supprimé(s), {len(unchanged)} inchangé(s)")
+
+    if manifest is not None and not changed and not deleted:
+        save_manifest(files)  # Met à jour les dates de modification
+        update_sidecars()
+        log("✅ Base vectorielle déjà à jour.")
+        return
+
+    deduplicator = ChunkDeduplicator(near_threshold=DEDUP_THRESHOLD) if DEDUP else None
+    embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+
+    writer = StoreWriter(STORE_DIR, model_name=EMBEDDING_MODEL, dtype=STORE_DTYPE)
+    try:
+        # Conservation des chunks des fichiers inchangés, recopiés par lots depuis la base existante
+        if manifest is not None:
+            reader = StoreReader(STORE_DIR)
+            unchanged, changed = release_duplicates(reader, unchanged, changed)
+            kept_sources = set(unchanged)
+            row = 0
+            for embeddings, texts, metadatas in reader.iter_batches(EMBED_BATCH_SIZE):
+                keep = [i for i, metadata in enumerate(metadatas) if metadata.get("source") in kept_sources]
+                for new_row, i in enumerate(keep, start=writer.count):
+                    if deduplicator is not None:
+                        deduplicator.register(texts[i], new_row)
+                    for metadata in reader.duplicates.get(row + i, []):
+                        if metadata.get("source") in kept_sources:
+                            writer.add_duplicate(new_row, metadata)
+                writer.append(embeddings[keep], [texts[i] for i in keep], [metadatas[i] for i in keep])
+                row += len(texts)
+            reader.close()
+            log(f"  ♻️ {writer.count} chunks réutilisés")
+
+        # Chargement, découpage en truncks et encodage par lots des documents ajoutés ou modifiés (CSV + PDF + DOCX)
+        log("🔄 Chargement des documents")
+        model = None
+        encoded = 0
+
+        # Le modèle n'est chargé que si des textes ne sont pas dans le cache. L'import (torch) est fait ici : les
+        # processus d'ingestion réimportent ce module au démarrage (spawn sous Windows et macOS)
+        def encode(texts):
+            nonlocal model
+            if model is None:
+                from sentence_transformers import SentenceTransformer # https://www.sbert.net/index.html
+                model = SentenceTransformer(EMBEDDING_MODEL)
+            return model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
+
+        for doc_splits in batched(ingest_files(changed), EMBED_BATCH_SIZE):
+            # Élimination des doublons : seuls les chunks conservés sont encodés
+            if deduplicator is not None:
+                unique = []
+                for doc in doc_splits:
+                    survivor, key = deduplicator.find(doc.page_content)
+                    if survivor is None:
+                        deduplicator.add(key, writer.count + len(unique))
+                        unique.append(doc)
+                    else:
+                        writer.add_duplicate(survivor, doc.metadata)
+                doc_splits = unique
+                if not doc_splits:
+                    continue
+
+            # Généreation des embeddings avec SentenceTransformer (ou lecture dans le cache)
+            texts = [doc.page_content for doc in doc_splits]
+            embeddings = embedding_cache.encode(texts, encode)
+            writer.append(embeddings, texts, [doc.metadata for doc in doc_splits])
+            encoded += len(texts)
+        log(f"  🧮 {encoded} nouveaux chunks encodés ({embedding_cache.hits} lus dans le cache, {embedding_cache.misses} calculés)")
+        if deduplicator is not None:
+            log(f"  ✂️ Doublons fusionnés : {deduplicator.exact_duplicates} exacts, {deduplicator.near_duplicates} approchés")
+
+        if writer.count == 0:
+            writer.abort()
+            if store_exists(STORE_DIR):
+                # Tous les fichiers sources ont été supprimés : la base et le manifeste aussi
+                remove_store(STORE_DIR)
+                if os.path.exists(MANIFEST_PATH):
+                    os.remove(MANIFEST_PATH)
+                log("🗑️ Plus aucun fichier source : base vectorielle supprimée.")
+            log("❌ Aucun document à indexer dans ./Sources/.")
+            return
+
+        # Sauvegarde du VectorStore et de ses fichiers annexes, publiés d'un coup, puis du manifeste
+        log(f'- Génération de la base vectorielle')
+        writer.close()
+        build_sidecars(writer.version_dir)
+        publish_store(writer.version_dir, STORE_DIR)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        embedding_cache.close()
+        if deduplicator is not None:
+            deduplicator.close()
+
+    save_manifest(files)
+    log(f"✅ Base vectorielle créée et sauvegardée ({writer.count} chunks).")
 
-# Sauvegarde du VectorStore
-vectorstore.persist()
-log("✅ Base vectorielle créée et sauvegardée.") 
\ No newline at end of file
+if __name__ == '__main__':
+    build_store()
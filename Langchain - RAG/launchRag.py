@@ -1,19 +1,131 @@
 from langchain_community.document_loaders import CSVLoader, PyMuPDFLoader, Docx2txtLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from langchain_community.vectorstores import SKLearnVectorStore
-from sentence_transformers import SentenceTransformer # https://www.sbert.net/index.html
 from langchain.embeddings.base import Embeddings
 
-from langchain_ollama import ChatOllama
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
+from langchain_core.callbacks import AsyncCallbackHandler
 from langchain.schema import Document
 
 import os
-
-# Chemin de sauvegarde du VectorStore
-PERSIST_PATH = os.path.join('./Store/', "vectorstore.pqt")
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from vectorStore import STORE_DIR, StoreReader, StoreRetriever, store_exists, convert_parquet_store
+from annIndex import load_index
+from quantization import load_quantization
+from embeddingCache import EmbeddingCache, text_key
+from caches import LRUCache, SemanticCache
+from lexicalIndex import load_bm25, identifier_terms
+from llmCache import LLMResponseCache
+from ollamaPool import OllamaPool
+from contextPacking import pack_context
+from relevanceFilter import RelevanceFilter
+from tracing import Tracer, traced, span, current_span, current_trace, render_gauges
+
+# Chemin de sauvegarde de l'ancien VectorStore (parquet), converti au premier démarrage
+PERSIST_PATH = os.path.join(STORE_DIR, "vectorstore.pqt")
+
+# Modèle d'embedding (identique à celui de generateStore)
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Nombre de documents renvoyés par le retriever (as_retriever(k=1) était ignoré, SKLearnVectorStore en renvoyait 4)
+RETRIEVER_K = 4
+
+# Index approximatif (construit par generateStore) : utilisé à partir de ANN_MIN_SIZE chunks, recherche exacte en deçà.
+# ANN_NPROBE (IVF) et ANN_EF (HNSW) augmentent le rappel au prix de la latence.
+ANN_MIN_SIZE = 20000
+ANN_NPROBE = 8
+ANN_EF = 64
+
+# Embeddings quantifiés (détectés automatiquement) : nombre de candidats re-classés avec les embeddings exacts (k * QUANT_RERANK), 0 pour désactiver
+QUANT_RERANK = 4
+
+# Caches en mémoire des embeddings de questions et des résultats du retriever (vidés quand la base est remplacée)
+QUERY_CACHE_SIZE = 1024
+RESULT_CACHE_SIZE = 1024
+CACHE_TTL = 3600  # Secondes
+
+# Recherche hybride : fusion (RRF) des HYBRID_CANDIDATES meilleurs chunks par embeddings et par BM25, si l'index BM25 existe
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+
+# Cache sémantique des réponses validées : similarité cosinus minimale entre la nouvelle question et une question
+# déjà traitée, vidé à chaque reconstruction de la base
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL = CACHE_TTL
+
+# Client Ollama partagé par toutes les chaînes : nombre maximal de générations simultanées (les autres attendent dans
+# une file) et durée pendant laquelle Ollama garde le modèle chargé
+OLLAMA_MODEL = "mistral:latest"
+OLLAMA_MAX_CONCURRENCY = 2
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Cache persistant des réponses des LLM (température 0) et chaînes qui l'utilisent (False pour le contourner)
+LLM_CACHE_MAX_ENTRIES = 100000
+LLM_CACHE_CHAINS = {
+    "retrieval_grader": True,
+    "generate": True,
+    "hallucination_grader": True,
+    "answer_grader": True,
+    "question_rewriter": True,
+    "batch_retrieval_grader": True,
+}
+
+# Démarrage rapide : le modèle d'embedding est chargé en arrière-plan (sinon au démarrage). WARMUP lance en plus
+# le préchauffage (modèle d'embedding, retriever et modèle Ollama) en arrière-plan une fois le RAG prêt.
+FAST_START = True
+WARMUP = False
+WARMUP_QUESTION = "Quelles sont les interfaces ?"
+
+# Pré-filtre local avant la notation par le LLM : documents de similarité cosinus >= PREFILTER_ACCEPT jugés pertinents,
+# <= PREFILTER_REJECT non pertinents, les autres notés par le LLM. PREFILTER_CROSS_ENCODER (nom d'un modèle
+# sentence_transformers) départage les cas limites avec ses propres seuils. Seuils à choisir avec calibrateFilter.py.
+PREFILTER = False
+PREFILTER_ACCEPT = 0.75
+PREFILTER_REJECT = 0.25
+PREFILTER_CROSS_ENCODER = None  # Ex : "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+PREFILTER_CROSS_ACCEPT = 3.0
+PREFILTER_CROSS_REJECT = -3.0
+
+# Filtrage des documents récupérés : "serial" (un appel LLM par document, l'un après l'autre), "batch" (un seul appel
+# notant tous les documents) ou "concurrent" (un appel par document, au plus GRADING_CONCURRENCY en parallèle)
+GRADING_MODE = "serial"
+GRADING_CONCURRENCY = 4
+
+# Budget (en tokens) du contexte inséré dans les prompts de génération et de vérification des hallucinations
+CONTEXT_TOKEN_BUDGET = 1536
+
+# Réécriture spéculative : la question est reformulée (et les documents de la reformulation récupérés) pendant le
+# filtrage et la génération, la nouvelle tentative n'attend donc plus la réécriture
+SPECULATIVE_REWRITE = False
+
+# Génération en streaming : les tokens de la réponse sont reçus au fur et à mesure (délai avant le premier token mesuré)
+# et transmis au client qui le demande (on_event de rag_pipeline, route /events de app.py)
+STREAM_GENERATION = True
+
+# Délais maximaux (secondes) de chaque étape du pipeline, None pour aucune limite
+STAGE_TIMEOUTS = {
+    "retrieve": 30,
+    "grade": 120,
+    "rewrite": 60,
+    "generate": 180,
+    "validate": 120,
+}
+
+# Fichier JSON lines des traces du pipeline (une ligne par question), None pour ne pas les écrire
+TRACE_FILE = None  # Ex : os.path.join("Logs", "traces.jsonl")
+
+# Réponse renvoyée quand aucune tentative n'a abouti
+NOT_FOUND_MESSAGE = "😞 Oups, nous n'avons pas trouvé l'information souhaitée! Tentez de reformuler votre question pour de meilleurs résultats."
+
+# Statistiques des composants du RAG chargé (nom -> fonction), renseignées par startRag
+stats_sources = {}
 
 active_log = False # Activer/désactiver l'affichage des logs
 
@@ -21,41 +133,420 @@ def log(message):
     if active_log:
         print(message)
 
-def startRag():
+# Traces des questions et métriques par étape
+tracer = Tracer(TRACE_FILE)
+
+# Boucle d'événements partagée par les versions synchrones des étapes, lancée dans un thread dédié au premier appel.
+# Les clients HTTP asynchrones (httpx.AsyncClient du ChatOllama partagé) gardent leurs connexions liées à la boucle qui
+# les a ouvertes : un asyncio.run() par appel les laisserait rattachées à une boucle fermée.
+_loop = None
+_loop_lock = threading.Lock()
+
+def event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rag-event-loop", daemon=True).start()
+        return _loop
+
+# Exécution d'une coroutine sur la boucle partagée depuis un thread quelconque, annulée si l'appelant est interrompu
+def run_sync(coroutine):
+    future = asyncio.run_coroutine_threadsafe(coroutine, event_loop())
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+# Exécution d'une étape du pipeline asynchrone dans son délai maximal (STAGE_TIMEOUTS)
+async def run_stage(name, coroutine):
+    timeout = STAGE_TIMEOUTS.get(name)
+    try:
+        return await asyncio.wait_for(coroutine, timeout)
+    except asyncio.TimeoutError:
+        log(f"⏱️ Délai dépassé pour l'étape {name} ({timeout}s)")
+        raise
+
+# 1️⃣ Étape : Récupération des documents
+@traced("retrieve")
+async def aretrieve(question, retriever):
+    log("---RETRIEVE---")
+    documents = await retriever.ainvoke(question)
+    current_span().set(documents_retrieved=len(documents))
+    for document in documents:
+        log(f'  📃 Document : {document.page_content}')
+    return documents
+
+def retrieve(question, retriever):
+    return run_sync(aretrieve(question, retriever))
+
+# Évaluateur notant tous les documents récupérés en un seul appel
+def build_batch_retrieval_grader(llm):
+
+    prompt = PromptTemplate(
+        template="""Tu es un évaluateur évaluant la pertinence de documents récupérés par rapport à une question d'un utilisateur. \n 
+        Voici les documents récupérés, numérotés : \n\n {documents} \n\n
+        Voici la question de l'utilisateur : {question} \n
+        Si un document contient des mots-clés liés à la question de l'utilisateur, note-le comme pertinent. \n
+        Ce n'est pas nécessaire que ce soit un test rigoureux. Le but est de filtrer les récupérations erronées. \n
+        Donne pour chaque document un score binaire « oui » ou « non » pour indiquer s'il est pertinent par rapport à la question. \n
+        Fournis les {count} scores au format JSON avec une clé unique « scores » contenant la liste des scores dans l'ordre des documents,
+        sans préambule ni explication.""",
+        input_variables=["question", "documents", "count"],
+    )
+
+    return prompt | llm | JsonOutputParser()
+
+# Notation de tous les documents en un appel, None si la réponse du LLM est inexploitable
+async def agrade_batch(question, documents, batch_grader):
+    numbered = "\n\n".join(f"[{i + 1}] {d.page_content}" for i, d in enumerate(documents))
+    try:
+        result = await batch_grader.ainvoke({"question": question, "documents": numbered, "count": len(documents)})
+        scores = [str(score).strip().lower() for score in result["scores"]]
+    except Exception as e:
+        log(f'  ⚠️ Notation groupée inexploitable : {e}')
+        return None
+    if len(scores) != len(documents):
+        log(f'  ⚠️ Notation groupée : {len(scores)} scores pour {len(documents)} documents')
+        return None
+    return scores
+
+# 2️⃣ Étape : Filtrage des documents
+# Le pré-filtre local tranche les cas évidents, seuls les documents restants sont notés par le LLM
+@traced("grade")
+async def agrade_documents(question, documents, retrieval_grader, batch_grader=None, mode=None, relevance_filter=None):
+    log("---CHECK RELEVANCE---")
+    mode = mode or GRADING_MODE
+
+    scores = [None] * len(documents)
+    if relevance_filter is not None:
+        scores = await asyncio.to_thread(relevance_filter.verdicts, question, documents)
+    pending = [i for i, score in enumerate(scores) if score is None]
+    pending_docs = [documents[i] for i in pending]
+    inputs = [{"question": question, "document": d.page_content} for d in pending_docs]
+
+    llm_scores = None
+    if mode == "batch" and batch_grader is not None and len(pending_docs) > 1:
+        llm_scores = await agrade_batch(question, pending_docs, batch_grader)
+    if llm_scores is None and mode in ("batch", "concurrent") and len(pending_docs) > 1:
+        results = await retrieval_grader.abatch(inputs, config={"max_concurrency": GRADING_CONCURRENCY})
+        llm_scores = [result["score"] for result in results]
+    if llm_scores is None:
+        llm_scores = [(await retrieval_grader.ainvoke(grader_input))["score"] for grader_input in inputs]
+    for i, score in zip(pending, llm_scores):
+        scores[i] = score
+
+    filtered_docs = []
+    for d, score in zip(documents, scores):
+        if score == "oui":
+            log(f'  ✅ Relevant : {d.page_content}')
+            filtered_docs.append(d)
+        else:
+            log(f'  ❌ Not relevant : {d.page_content}')
+    current_span().set(
+        mode=mode,
+        documents_graded=len(documents),
+        documents_prefiltered=len(documents) - len(pending),
+        documents_kept=len(filtered_docs),
+    )
+    return filtered_docs
+
+def grade_documents(question, documents, retrieval_grader, batch_grader=None, mode=None, relevance_filter=None):
+    return run_sync(agrade_documents(question, documents, retrieval_grader, batch_grader, mode, relevance_filter))
+
+# 3️⃣ Étape : Réécriture de la question si nécessaire
+@traced("rewrite")
+async def atransform_query(question, question_rewriter):
+    log("---TRANSFORM QUERY---")
+    better_question = await question_rewriter.ainvoke({"question": question})
+    log(f'📩 Nouvelle question : {better_question}')
+    return better_question
+
+# Réécriture anticipée : reformulation et récupération des documents de la nouvelle question
+@traced("speculate")
+async def aspeculate(question, question_rewriter, retriever):
+    better_question = await run_stage("rewrite", atransform_query(question, question_rewriter))
+    return better_question, await run_stage("retrieve", aretrieve(better_question, retriever))
+
+# Question de la tentative suivante et ses documents (None s'ils restent à récupérer). Une réécriture spéculative en
+# échec est remplacée par une reformulation normale.
+async def anext_question(question, question_rewriter, speculation):
+    if speculation is not None:
+        log("---SPECULATIVE REWRITE---")
+        try:
+            return await speculation
+        except Exception as e:
+            log(f"⚠️ Réécriture spéculative en échec ({e}), reformulation normale")
+    return await run_stage("rewrite", atransform_query(question, question_rewriter)), None
+
+# Abandon d'une réécriture spéculative : annulée avec ses appels en cours, ou son éventuelle erreur ignorée
+def drop_speculation(speculation):
+    if speculation is None:
+        return
+    if not speculation.done():
+        speculation.cancel()
+    elif not speculation.cancelled():
+        speculation.exception()
+
+# Contexte des prompts : texte des documents avec leur source, chunks recouvrants fusionnés, dans la limite du budget
+def format_docs(docs, max_tokens=CONTEXT_TOKEN_BUDGET):
+    context, stats = pack_context(docs, max_tokens)
+    log(f"  🧩 Contexte : {stats['blocks']} blocs / {stats['documents']} documents, {stats['tokens']} tokens")
+    return context
+
+# Réception des tokens de la réponse pendant la génération en streaming
+class TokenCallback(AsyncCallbackHandler):
+    def __init__(self, on_token):
+        self.on_token = on_token
+
+    async def on_llm_new_token(self, token, **kwargs):
+        self.on_token(token)
+
+# 4️⃣ Étape : Generation de la réponse avec le modèle LLM
+# Chaque token est transmis à on_event("token", ...) ; une réponse servie par le cache des réponses LLM l'est en une fois
+@traced("generate")
+async def agenerate(question, documents, rag_chain, on_event=None):
+    log("---GENERATE---")
+    trace = current_trace()
+    started = time.perf_counter()
+    streamed = False
+
+    def on_token(token):
+        nonlocal streamed
+        if not token:
+            return
+        if not streamed:
+            streamed = True
+            current_span().set(time_to_first_token=time.perf_counter() - started)
+            if trace is not None:
+                trace.first_token()
+        if on_event is not None:
+            on_event("token", {"attempt": trace.attempt if trace is not None else 1, "text": token})
+
+    generation = await rag_chain.ainvoke(
+        {"documents": format_docs(documents), "question": question},
+        config={"callbacks": [TokenCallback(on_token)]},
+    )
+    if not streamed:
+        on_token(generation)
+    log(f'📩 Réponse : {generation}')
+    return generation
+
+# 5️⃣ Étape : Vérification de la réponse (hallucination et pertinence)
+# Les deux évaluateurs sont interrogés en même temps : le premier « non » rend le verdict et annule l'autre requête
+@traced("validate")
+async def avalidate_answer(question, documents, generation, hallucination_grader, answer_grader):
+    log("---CHECK HALLUCINATIONS / CHECK ANSWER---")
+    checks = {
+        asyncio.create_task(hallucination_grader.ainvoke({"documents": format_docs(documents), "generation": generation})):
+            ("✅ Pas d'hallucination!", "❌ Hallucination détectée"),
+        asyncio.create_task(answer_grader.ainvoke({"question": question, "generation": generation})):
+            ("✅ Réponse pertinente!", "❌ Réponse incorrecte"),
+    }
+    pending = set(checks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                valid, invalid = checks[task]
+                if task.result()["score"] != "oui":
+                    log(invalid)
+                    current_span().set(valid=False)
+                    return False
+                log(valid)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    log(f'✅ Réponse validée!')
+    current_span().set(valid=True)
+    return True  # Réponse validée
+
+def validate_answer(question, documents, generation, hallucination_grader, answer_grader):
+    return run_sync(avalidate_answer(question, documents, generation, hallucination_grader, answer_grader))
+
+# Fonction principale qui exécute toutes les étapes, en asynchrone : les questions en cours attendent Ollama sur une
+# même boucle d'événements, une question annulée (task.cancel()) annule aussi ses appels en cours
+# on_event(nom, données), optionnel, reçoit les tokens de chaque réponse générée ("token") puis son verdict ("validation") :
+# une réponse rejetée est suivie de celle de la tentative suivante
+async def arag_pipeline(question, retriever, rag_chain, retrieval_grader, question_rewriter, hallucination_grader, answer_grader, batch_grader=None, answer_cache=None, speculative=None, relevance_filter=None, on_event=None):
+    max_attempts = 3  # Nombre maximum de reformulations
+    attempt = 0  # Compteur de tentatives
+    speculative = SPECULATIVE_REWRITE if speculative is None else speculative
+    documents = None  # Documents déjà récupérés par la réécriture spéculative
+    speculation = None  # Tâche de réécriture spéculative en cours
+
+    with tracer.trace(question) as trace:
+        # Étape 0 : Réponse déjà validée pour une question proche
+        if answer_cache is not None:
+            await asyncio.to_thread(retriever.refresh)
+            build_id = retriever.snapshot()[0].meta.get("build_id")
+            question_embedding = await asyncio.to_thread(retriever.embed_query, question)
+            question_identifiers = identifier_terms(question)
+            with span("answer_cache") as current:
+                cached = answer_cache.get(question_embedding, build_id, identifiers=question_identifiers)
+                current.set(hit=cached is not None)
+            if cached is not None:
+                log(f'⚡ Réponse servie par le cache sémantique : {answer_cache.stats()}')
+                trace.outcome = "cached"
+                return cached
+
+        try:
+            while attempt < max_attempts:
+                trace.attempt = attempt + 1
+
+                # Étape 1 : Récupération
+                if documents is None:
+                    documents = await run_stage("retrieve", aretrieve(question, retriever))
+
+                # Réécriture spéculative, en parallèle du filtrage (inutile à la dernière tentative)
+                speculation = None
+                if speculative and attempt + 1 < max_attempts:
+                    speculation = asyncio.create_task(aspeculate(question, question_rewriter, retriever))
+
+                # Étape 2 : Filtrage des documents
+                filtered_docs = await run_stage("grade", agrade_documents(question, documents, retrieval_grader, batch_grader, relevance_filter=relevance_filter))
+
+                if not filtered_docs:
+                    # Aucun document pertinent → reformuler la question
+                    attempt += 1
+                    if attempt < max_attempts:
+                        question, documents = await anext_question(question, question_rewriter, speculation)
+                        continue  # Recommencer avec la question reformulée
+                    else:
+                        # Si on atteint la limite de tentatives
+                        trace.outcome = "not_found"
+                        return NOT_FOUND_MESSAGE
+
+                # Documents pertinents : la réécriture spéculative est abandonnée, elle occuperait une place auprès
+                # d'Ollama pendant la génération et la vérification (une réponse rejetée sera reformulée normalement)
+                drop_speculation(speculation)
+                speculation = None
+
+                # Étape 3 : Generation de la réponse
+                generation = await run_stage("generate", agenerate(question, filtered_docs, rag_chain, on_event))
+
+                # Étape 4 : Vérification de la réponse
+                valid = await run_stage("validate", avalidate_answer(question, filtered_docs, generation, hallucination_grader, answer_grader))
+                if on_event is not None:
+                    on_event("validation", {"attempt": trace.attempt, "valid": valid})
+                if valid:
+                    if answer_cache is not None:
+                        sources = [text_key(d.page_content).hex() for d in filtered_docs]
+                        answer_cache.put(question_embedding, generation, sources, build_id, identifiers=question_identifiers)
+                    trace.outcome = "answered"
+                    return generation  # Réponse validée, on sort de la boucle
+                else:
+                    # Si la réponse n'est pas fiable, reformuler la question
+                    attempt += 1
+                    if attempt < max_attempts:
+                        question, documents = await anext_question(question, question_rewriter, speculation)
+                    else:
+                        trace.outcome = "not_found"
+                        return NOT_FOUND_MESSAGE
+        finally:
+            # Réécriture spéculative inutile (erreur ou annulation) : annulée avec ses appels en cours
+            drop_speculation(speculation)
+
+# Version synchrone du pipeline : la question est traitée sur la boucle partagée, avec celles des autres threads
+def rag_pipeline(question, retriever, rag_chain, retrieval_grader, question_rewriter, hallucination_grader, answer_grader, batch_grader=None, answer_cache=None, speculative=None, relevance_filter=None, on_event=None):
+    return run_sync(arag_pipeline(
+        question, retriever, rag_chain, retrieval_grader, question_rewriter, hallucination_grader, answer_grader,
+        batch_grader=batch_grader, answer_cache=answer_cache, speculative=speculative, relevance_filter=relevance_filter,
+        on_event=on_event,
+    ))
+
+# Statistiques du RAG : caches, file d'attente et temps de réponse du client Ollama
+def rag_stats():
+    return {name: stats() for name, stats in stats_sources.items()}
+
+# Métriques au format texte Prometheus : étapes du pipeline (traces) et statistiques des composants
+def rag_metrics():
+    return tracer.metrics.render() + render_gauges(rag_stats())
+
+# Préchauffage optionnel : chargement du modèle d'embedding, première recherche et chargement du modèle Ollama
+def warm_up(retriever, pool, question=WARMUP_QUESTION):
+    start = time.perf_counter()
+    retriever.embedding.load()
+    retriever.invoke(question)
+    pool.chain("warm_up", cache=False).invoke("Réponds uniquement « ok ».")
+    log(f"🔥 Préchauffage terminé en {time.perf_counter() - start:.1f}s")
+
+def startRag(fast_start=FAST_START, warmup=WARMUP):
     print("🔄 Chargement du RAG...")
+    start = time.perf_counter()
+
+    # Charger le modèle d'embedding (en arrière-plan en démarrage rapide) et son cache persistant
+    def load_model():
+        from sentence_transformers import SentenceTransformer # https://www.sbert.net/index.html (import lent : torch)
+
+        model_start = time.perf_counter()
+        model = SentenceTransformer(EMBEDDING_MODEL)
+        log(f"🔄 Modèle d'embedding chargé en {time.perf_counter() - model_start:.1f}s")
+        return model
 
-    # Charger le modèle d'embedding
-    model = SentenceTransformer("all-MiniLM-L6-v2")
+    model_loader = ThreadPoolExecutor(max_workers=1)
+    model_future = model_loader.submit(load_model)
+    model_loader.shutdown(wait=not fast_start)
+    embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+
+    # Fonction de calcul des embeddings des questions, le modèle n'est attendu que si l'embedding n'est pas en cache
+    class QueryEmbeddings(Embeddings):
+        def load(self):
+            return model_future.result()
+
+        def encode(self, texts):
+            return self.load().encode(texts)
 
-    # Fonction de récupération des embeddings
-    class PrecomputedEmbeddings(Embeddings):
-        def __init__(self, precomputed_vectors):
-            self.precomputed_vectors = precomputed_vectors  # Stocke les embeddings calculés
-    
         def embed_documents(self, texts):
-            return self.precomputed_vectors # Retourne les embeddings déjà calculés.
-    
+            return embedding_cache.encode(texts, self.encode)
+
         def embed_query(self, text):
-            return model.encode([text])[0]  # Génère l'embedding pour une nouvelle requête et retourne un seul vecteur
+            return embedding_cache.encode([text], self.encode)[0]  # Génère l'embedding pour une nouvelle requête et retourne un seul vecteur
+
+    # Conversion unique d'un ancien VectorStore parquet
+    if not store_exists(STORE_DIR) and os.path.exists(PERSIST_PATH):
+        print("🔄 Conversion du VectorStore parquet au format natif...")
+        convert_parquet_store(PERSIST_PATH, STORE_DIR)
 
     # Vérifier si le VectorStore existe déjà
-    if os.path.exists(PERSIST_PATH):   
-        # Charger le VectorStore existant
-        vectorstore = SKLearnVectorStore(
-            persist_path=PERSIST_PATH,
-            embedding=PrecomputedEmbeddings([]),  # Embeddings fictifs pour respecter l'interface
-            serializer="parquet"
-        )
+    if store_exists(STORE_DIR):
+        # Charger le VectorStore existant (embeddings projetés en mémoire, sans copie), ses index et ses codes quantifiés
+        def load_store():
+            vectorstore = StoreReader(STORE_DIR)
+            quantized = load_quantization(vectorstore, rerank=QUANT_RERANK)
+            index = load_index(vectorstore, min_size=ANN_MIN_SIZE, nprobe=ANN_NPROBE, ef=ANN_EF, scorer=quantized)
+            lexical = load_bm25(vectorstore)
+            log("🔄 VectorStore chargé")
+            return vectorstore, index or quantized, lexical
+
+        vectorstore, index, lexical = load_store()
 
         # Créer un retriver
-        retriever = vectorstore.as_retriever(k=1)
+        retriever = StoreRetriever(
+            store=vectorstore,
+            embedding=QueryEmbeddings(),
+            k=RETRIEVER_K,
+            index=index,
+            lexical=lexical,
+            hybrid_candidates=HYBRID_CANDIDATES,
+            rrf_k=RRF_K,
+            loader=load_store,
+            query_cache=LRUCache(QUERY_CACHE_SIZE, ttl=CACHE_TTL),
+            result_cache=LRUCache(RESULT_CACHE_SIZE, ttl=CACHE_TTL),
+        )
+
+        # Client Ollama partagé et cache des réponses des LLM
+        llm_cache = LLMResponseCache(max_entries=LLM_CACHE_MAX_ENTRIES)
+        pool = OllamaPool(OLLAMA_MODEL, max_concurrency=OLLAMA_MAX_CONCURRENCY, keep_alive=OLLAMA_KEEP_ALIVE, cache=llm_cache)
+
+        def chain_llm(name, format=None, stream=False):
+            return pool.chain(name, format=format, cache=LLM_CACHE_CHAINS.get(name, True), stream=stream)
 
         ### Retrieval Grader
-        llm = ChatOllama(
-            model="mistral:latest",
-            format="json",
-            temperature=0,
-        )
+        llm = chain_llm("retrieval_grader", format="json")
 
         prompt = PromptTemplate(
             template="""Tu es un évaluateur évaluant la pertinence d'un document récupéré par rapport à une question d'un utilisateur. \n 
@@ -69,15 +560,9 @@ def startRag():
         )
 
         retrieval_grader = prompt | llm | JsonOutputParser()
-        question = "agent memory"
-        docs = retriever.invoke(question)
-        doc_txt = docs[1].page_content
 
         ### Generate
-        llm = ChatOllama(
-            model="mistral:latest",
-            temperature=0,
-        )
+        llm = chain_llm("generate", stream=STREAM_GENERATION)
 
         prompt = PromptTemplate(
             template="""Utilise les documents suivants pour répondre à la question.
@@ -90,18 +575,10 @@ def startRag():
             input_variables=["question", "documents"],
         )
 
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-
         rag_chain = prompt | llm | StrOutputParser()
-        generation = rag_chain.invoke({"documents": docs, "question": question})
 
         ### Hallucination Grader
-        llm = ChatOllama(
-            model="mistral:latest",
-            format="json",
-            temperature=0,
-        )
+        llm = chain_llm("hallucination_grader", format="json")
 
         prompt = PromptTemplate(
             template="""Tu es un évaluateur qui évalue si une réponse est fondée/étayée par un ensemble de faits. \n 
@@ -116,14 +593,9 @@ def startRag():
         )
 
         hallucination_grader = prompt | llm | JsonOutputParser()
-        hallucination_grader.invoke({"documents": docs, "generation": generation})
 
         ### Answer Grader
-        llm = ChatOllama(
-            model="mistral:latest",
-            format="json",
-            temperature=0,
-        )
+        llm = chain_llm("answer_grader", format="json")
 
         prompt = PromptTemplate(
             template="""Tu es un évaluateur qui évalue si une réponse est utile pour résoudre une question. \n 
@@ -138,13 +610,9 @@ def startRag():
         )
 
         answer_grader = prompt | llm | JsonOutputParser()
-        answer_grader.invoke({"question": question, "generation": generation})
 
         ### Question Re-writer
-        llm = ChatOllama(
-            model="mistral:latest",
-            temperature=0,
-        )
+        llm = chain_llm("question_rewriter")
 
         re_write_prompt = PromptTemplate(
             template="""Tu es un reformulateur de questions qui convertit une question d'entrée en une meilleure version optimisée \n 
@@ -155,102 +623,38 @@ def startRag():
         )
 
         question_rewriter = re_write_prompt | llm | StrOutputParser()
-        question_rewriter.invoke({"question": question})
-
-        # 1️⃣ Étape : Récupération des documents
-        def retrieve(question, retriever):
-            log("---RETRIEVE---")
-            documents = retriever.invoke(question)
-            for document in documents:
-                log(f'  📃 Document : {document.page_content}')
-            return documents
-
-        # 2️⃣ Étape : Filtrage des documents
-        def grade_documents(question, documents, retrieval_grader):
-            log("---CHECK RELEVANCE---")
-            filtered_docs = []
-            for d in documents:
-                score = retrieval_grader.invoke({"question": question, "document": d.page_content})
-                if score["score"] == "oui":
-                    log(f'  ✅ Relevant : {d.page_content}')
-                    filtered_docs.append(d)
-                else:
-                    log(f'  ❌ Not relevant : {d.page_content}')
-            return filtered_docs
-
-        # 3️⃣ Étape : Réécriture de la question si nécessaire
-        def transform_query(question, question_rewriter):
-            log("---TRANSFORM QUERY---")
-            better_question = question_rewriter.invoke({"question": question})
-            log(f'📩 Nouvelle question : {better_question}')
-            return better_question
-
-        # 4️⃣ Étape : Generation de la réponse avec le modèle LLM
-        def generate(question, documents, rag_chain):
-            log("---GENERATE---")
-            generation = rag_chain.invoke({"documents": documents, "question": question})
-            log(f'📩 Réponse : {generation}')
-            return generation
-
-        # 5️⃣ Étape : Vérification de la réponse (hallucination et pertinence)
-        def validate_answer(question, documents, generation, hallucination_grader, answer_grader):
-            log("---CHECK HALLUCINATIONS---")
-            score = hallucination_grader.invoke({"documents": documents, "generation": generation})
-    
-            if score["score"] != "oui":
-                log(f'❌ Hallucination détectée')
-                return False
-            log(f"✅ Pas d'hallucination!")
-
-            log("---CHECK ANSWER---")
-            score = answer_grader.invoke({"question": question, "generation": generation})
-    
-            if score["score"] != "oui":
-                log(f'❌ Réponse incorrecte')
-                return False
-    
-            log(f'✅ Réponse validée!')
-            return True  # Réponse validée
-
-        # Fonction principale qui exécute toutes les étapes
-        def rag_pipeline(question, retriever, rag_chain, retrieval_grader, question_rewriter, hallucination_grader, answer_grader):
-            max_attempts = 3  # Nombre maximum de reformulations
-            attempt = 0  # Compteur de tentatives
-
-            while attempt < max_attempts:
-                # Étape 1 : Récupération
-                documents = retrieve(question, retriever)
-
-                # Étape 2 : Filtrage des documents
-                filtered_docs = grade_documents(question, documents, retrieval_grader)
-
-                if not filtered_docs:
-                    # Aucun document pertinent → reformuler la question
-                    attempt += 1
-                    if attempt < max_attempts:
-                        question = transform_query(question, question_rewriter)
-                        continue  # Recommencer avec la question reformulée
-                    else:
-                        # Si on atteint la limite de tentatives
-                        return "😞 Oups, nous n'avons pas trouvé l'information souhaitée! Tentez de reformuler votre question pour de meilleurs résultats."
-
-                # Étape 3 : Generation de la réponse
-                generation = generate(question, filtered_docs, rag_chain)
-
-                # Étape 4 : Vérification de la réponse
-                if validate_answer(question, filtered_docs, generation, hallucination_grader, answer_grader):
-                    return generation  # Réponse validée, on sort de la boucle
-                else:
-                    # Si la réponse n'est pas fiable, reformuler la question
-                    attempt += 1
-                    if attempt < max_attempts:
-                        question = transform_query(question, question_rewriter)
-                    else:
-                        return "😞 Oups, nous n'avons pas trouvé l'information souhaitée! Tentez de reformuler votre question pour de meilleurs résultats."
-        
-        print("✅ RAG chargé.")
 
-        return rag_pipeline, retriever, rag_chain, retrieval_grader, question_rewriter, hallucination_grader, answer_grader
+        ### Batch Retrieval Grader
+        batch_retrieval_grader = build_batch_retrieval_grader(chain_llm("batch_retrieval_grader", format="json"))
+
+        ### Relevance Pre-filter
+        relevance_filter = None
+        if PREFILTER:
+            relevance_filter = RelevanceFilter(
+                accept=PREFILTER_ACCEPT,
+                reject=PREFILTER_REJECT,
+                cross_encoder=PREFILTER_CROSS_ENCODER,
+                cross_accept=PREFILTER_CROSS_ACCEPT,
+                cross_reject=PREFILTER_CROSS_REJECT,
+            )
+
+        ### Semantic Answer Cache
+        answer_cache = SemanticCache(ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL)
+
+        stats_sources.update({
+            "retriever": retriever.cache_stats,
+            "answer_cache": answer_cache.stats,
+            "llm_cache": llm_cache.stats,
+            "ollama": pool.stats,
+        })
+
+        # Préchauffage optionnel, sans retarder la mise à disposition du RAG
+        if warmup:
+            threading.Thread(target=warm_up, args=(retriever, pool), daemon=True).start()
+
+        print(f"✅ RAG chargé en {time.perf_counter() - start:.2f}s.")
+
+        return partial(rag_pipeline, batch_grader=batch_retrieval_grader, answer_cache=answer_cache, relevance_filter=relevance_filter), retriever, rag_chain, retrieval_grader, question_rewriter, hallucination_grader, answer_grader
     else:
         # Si la base vectorielle n'existe pas
         print("❌ Aucun VectorStore existant, créez en un avec generateStore.")
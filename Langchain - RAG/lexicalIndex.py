@@ -0,0 +1,177 @@
+import numpy as np
+
+import os
+import re
+import json
+import math
+import time
+
+from vectorStore import save_npy
+
+'''
+   Index lexical BM25 du VectorStore natif, utilisé avec la recherche par embeddings (recherche hybride).
+
+   Les noms d'interface et codes d'erreur (ex : "SAP_PAYROLL", "ERR-404") sont conservés comme un seul terme, en plus
+   de leurs parties. L'index est stocké sous forme de listes de postings triées :
+       - bm25_terms.json   : vocabulaire (terme -> numéro)
+       - bm25_offsets.npy  : début de la liste de chaque terme
+       - bm25_docs.npy     : numéros des chunks, triés par terme puis par chunk
+       - bm25_tfs.npy      : fréquence du terme dans le chunk
+       - bm25_lengths.npy  : nombre de termes de chaque chunk
+       - bm25.json         : paramètres et build_id de la base
+
+   Les classements lexical et dense sont fusionnés par Reciprocal Rank Fusion (vectorStore.StoreRetriever).
+
+   Auteur : Cyril Bouvart
+'''
+
+BM25_META_FILE = "bm25.json"
+BM25_TERMS_FILE = "bm25_terms.json"
+BM25_OFFSETS_FILE = "bm25_offsets.npy"
+BM25_DOCS_FILE = "bm25_docs.npy"
+BM25_TFS_FILE = "bm25_tfs.npy"
+BM25_LENGTHS_FILE = "bm25_lengths.npy"
+BM25_FILES = (BM25_META_FILE, BM25_TERMS_FILE, BM25_OFFSETS_FILE, BM25_DOCS_FILE, BM25_TFS_FILE, BM25_LENGTHS_FILE)  # Métadonnées en premier
+
+active_log = True # Activer/désactiver l'affichage des logs
+
+def log(message):
+    if active_log:
+        print(message)
+
+# Termes composés (lettres, chiffres, _ reliés par - . /) et leurs parties, en minuscules
+def tokenize(text):
+    tokens = []
+    for compound in re.findall(r"\w+(?:[-./]\w+)*", text.lower()):
+        tokens.append(compound)
+        parts = re.split(r"[-./_]", compound)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+# Identifiants d'un texte (codes d'erreur, noms d'interface, sigles) : termes composés contenant un chiffre ou un
+# séparateur, ou écrits en majuscules, en minuscules
+def identifier_terms(text):
+    return frozenset(
+        compound.lower()
+        for compound in re.findall(r"\w+(?:[-./]\w+)*", text)
+        if re.search(r"[\d\-./_]", compound) or (len(compound) > 1 and compound.isupper())
+    )
+
+class BM25Index:
+    def __init__(self, terms, offsets, docs, tfs, lengths, k1=1.2, b=0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    # Construction par lots à partir de la base : (terme, chunk, fréquence) puis tri par terme
+    @classmethod
+    def build(cls, store, batch_size=1024, k1=1.2, b=0.75):
+        terms = {}
+        term_ids, doc_ids, frequencies, lengths = [], [], [], []
+        row = 0
+        for _, texts, _ in store.iter_batches(batch_size):
+            batch_terms, batch_docs, batch_tfs = [], [], []
+            for text in texts:
+                tokens = tokenize(text)
+                lengths.append(len(tokens))
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, count in counts.items():
+                    batch_terms.append(terms.setdefault(token, len(terms)))
+                    batch_docs.append(row)
+                    batch_tfs.append(count)
+                row += 1
+            term_ids.append(np.array(batch_terms, dtype=np.int32))
+            doc_ids.append(np.array(batch_docs, dtype=np.int32))
+            frequencies.append(np.array(batch_tfs, dtype=np.uint16))
+
+        term_ids = np.concatenate(term_ids) if term_ids else np.empty(0, dtype=np.int32)
+        doc_ids = np.concatenate(doc_ids) if doc_ids else np.empty(0, dtype=np.int32)
+        frequencies = np.concatenate(frequencies) if frequencies else np.empty(0, dtype=np.uint16)
+
+        order = np.lexsort((doc_ids, term_ids))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(terms)))]).astype(np.int64)
+        return cls(terms, offsets, doc_ids[order], frequencies[order], np.array(lengths, dtype=np.int32), k1=k1, b=b)
+
+    def save(self, store, directory):
+        # Fichiers écrits d'un coup (fichiers temporaires), dans le dossier d'une version non publiée
+        tmp_terms = os.path.join(directory, BM25_TERMS_FILE + ".tmp")
+        with open(tmp_terms, "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+        os.replace(tmp_terms, os.path.join(directory, BM25_TERMS_FILE))
+        save_npy(os.path.join(directory, BM25_OFFSETS_FILE), self.offsets)
+        save_npy(os.path.join(directory, BM25_DOCS_FILE), self.docs)
+        save_npy(os.path.join(directory, BM25_TFS_FILE), self.tfs)
+        save_npy(os.path.join(directory, BM25_LENGTHS_FILE), self.lengths)
+        meta = {"store_build_id": store.meta.get("build_id"), "k1": self.k1, "b": self.b, "terms": len(self.terms)}
+        tmp_path = os.path.join(directory, BM25_META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(directory, BM25_META_FILE))
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, BM25_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, BM25_TERMS_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        return cls(
+            terms,
+            np.load(os.path.join(directory, BM25_OFFSETS_FILE)),
+            np.load(os.path.join(directory, BM25_DOCS_FILE), mmap_mode="r"),
+            np.load(os.path.join(directory, BM25_TFS_FILE), mmap_mode="r"),
+            np.load(os.path.join(directory, BM25_LENGTHS_FILE)),
+            k1=meta["k1"],
+            b=meta["b"],
+        )
+
+    # Les n chunks de meilleur score BM25 : (indices, scores) triés
+    def search(self, query, n):
+        count = len(self.lengths)
+        all_docs, all_scores = [], []
+        for token in set(tokenize(query)):
+            term = self.terms.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs = np.asarray(self.docs[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[docs] / max(self.average_length, 1e-9))
+            all_docs.append(docs)
+            all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+
+        if not all_docs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        docs, inverse = np.unique(np.concatenate(all_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        top = np.argsort(-scores, kind="stable")[:n]
+        return docs[top].astype(np.int64), scores[top]
+
+def build_bm25(store, directory=None):
+    directory = store.directory if directory is None else directory
+    start = time.perf_counter()
+    index = BM25Index.build(store)
+    index.save(store, directory)
+    log(f"  🔤 Index BM25 construit en {time.perf_counter() - start:.1f}s ({len(index.terms)} termes)")
+    return index
+
+# Chargement de l'index BM25 de la base, None si absent ou obsolète
+def load_bm25(store, directory=None):
+    directory = store.directory if directory is None else directory
+    meta_path = os.path.join(directory, BM25_META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("store_build_id") != store.meta.get("build_id"):
+        log("⚠️ Index BM25 obsolète, recherche par embeddings seule (relancez generateStore).")
+        return None
+    return BM25Index.load(directory)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from vectorStore import STORE_DIR
+
+'''
+   Cache persistant (SQLite) des réponses des LLM à température 0 : le même prompt donne la même réponse.
+
+   La clé est le hash du couple (paramètres du modèle, prompt rendu) : le nom du modèle, le format (json ou texte) et la
+   température font partie des paramètres fournis par LangChain. Les notations répétées (question, chunk) et les
+   reformulations déjà calculées sont relues sans appel à Ollama. Le nombre d'entrées est borné, les moins récemment
+   utilisées sont supprimées en premier.
+
+   Le cache est consulté par OllamaPool avant la file d'attente des appels : cache=False le désactive pour une chaîne.
+
+   Auteur : Cyril Bouvart
+'''
+
+# Chemin du cache, conservé d'un démarrage à l'autre (indépendant de la base, les prompts contiennent les chunks)
+LLM_CACHE_PATH = os.path.join(STORE_DIR, "llm_cache.sqlite")
+
+def prompt_key(prompt, llm_string):
+    return hashlib.blake2b(f"{llm_string}\x00{prompt}".encode("utf-8"), digest_size=16).digest()
+
+class LLMResponseCache(BaseCache):
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key BLOB PRIMARY KEY, generations TEXT NOT NULL, accessed REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.connection.commit()
+        self.count = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def lookup(self, prompt, llm_string):
+        key = prompt_key(prompt, llm_string)
+        with self.lock:
+            row = self.connection.execute("SELECT generations FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            self.hits += 1
+        return [loads(generation) for generation in json.loads(row[0])]
+
+    def update(self, prompt, llm_string, return_val):
+        key = prompt_key(prompt, llm_string)
+        generations = json.dumps([dumps(generation) for generation in return_val])
+        with self.lock:
+            inserted = self.connection.execute(
+                "INSERT OR IGNORE INTO responses (key, generations, accessed) VALUES (?, ?, ?)", (key, generations, time.time())
+            ).rowcount
+            if inserted:
+                self.count += 1
+            else:
+                self.connection.execute(
+                    "UPDATE responses SET generations = ?, accessed = ? WHERE key = ?", (generations, time.time(), key)
+                )
+
+            # Suppression des entrées les moins récemment utilisées au-delà de la limite
+            if self.count > self.max_entries:
+                excess = self.count - self.max_entries
+                self.connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (excess,)
+                )
+                self.count -= excess
+                self.evictions += excess
+            self.connection.commit()
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            self.count = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": self.count,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,262 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+import httpx
+from langchain_ollama import ChatOllama
+from langchain_core.load import dumps
+from langchain_core.outputs import ChatGeneration
+from langchain_core.runnables import RunnableLambda
+
+from contextPacking import count_tokens
+from tracing import current_span
+
+'''
+   Client Ollama unique partagé par toutes les chaînes du RAG.
+
+   Un seul ChatOllama (un client HTTP synchrone et un asynchrone, connexions conservées) sert toutes les chaînes : le
+   format (json ou texte) est fixé par chaîne avec bind(format=...), le cache des réponses peut être contourné par
+   chaîne. Une chaîne en streaming reçoit la réponse token par token (callbacks on_llm_new_token).
+
+   Le cache des réponses est consulté avant la file d'attente (dans un thread pour les appels asynchrones : la boucle
+   d'événements partagée par toutes les questions n'attend jamais SQLite) : une réponse déjà connue est renvoyée sans
+   attendre la fin des générations en cours, et comptée à part (cache_hits) sans fausser les temps d'attente et de
+   réponse. Le nombre de générations simultanées envoyées au serveur Ollama est limité : les appels en excès attendent
+   dans une file, servie dans l'ordre d'arrivée. Un appel annulé (réponse devenue inutile) est compté à part
+   (cancelled), ni comme une erreur ni dans les temps de réponse.
+
+   Pour chaque chaîne, le temps d'attente dans la file et le temps de réponse du modèle sont mesurés séparément, ainsi
+   que la taille des prompts et des réponses en tokens. Les tokens sont aussi ajoutés au span de l'étape en cours
+   (tracing).
+
+   Auteur : Cyril Bouvart
+'''
+
+# Nombre de mesures conservées par chaîne pour les percentiles
+_SAMPLES = 1000
+
+# File d'attente des appels au modèle, servie dans l'ordre d'arrivée, au plus max_concurrency appels en cours.
+# Les threads (invoke) et les tâches asyncio (ainvoke) partagent la même file : une tâche en attente n'occupe aucun thread.
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.lock = threading.Lock()
+        self.queue = deque()  # Attentes : threading.Event ou (boucle, future)
+        self.active = 0
+
+    # Place attribuée aux premiers de la file (verrou déjà pris)
+    def _grant(self):
+        while self.queue and self.active < self.max_concurrency:
+            waiter = self.queue.popleft()
+            self.active += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def acquire(self):
+        with self.lock:
+            if not self.queue and self.active < self.max_concurrency:
+                self.active += 1
+                return
+            event = threading.Event()
+            self.queue.append(event)
+        event.wait()
+
+    # Une tâche annulée pendant l'attente quitte la file, ou rend sa place si elle venait de l'obtenir
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if not self.queue and self.active < self.max_concurrency:
+                self.active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self.queue.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self.lock:
+                granted = waiter not in self.queue
+                if not granted:
+                    self.queue.remove(waiter)
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+            self._grant()
+
+    def __len__(self):
+        return len(self.queue)
+
+# Temps d'attente et de réponse d'une chaîne, en secondes
+class CallStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0  # Réponses lues dans le cache, sans attente ni appel au modèle
+        self.cancelled = 0  # Appels annulés pendant la génération (résultat devenu inutile)
+        self.queue_wait = deque(maxlen=_SAMPLES)
+        self.model_time = deque(maxlen=_SAMPLES)
+        self.prompt_tokens = deque(maxlen=_SAMPLES)
+        self.completion_tokens = deque(maxlen=_SAMPLES)
+
+    def record(self, queue_wait, model_time, prompt_tokens, completion_tokens=0, error=False):
+        with self.lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.queue_wait.append(queue_wait)
+            self.model_time.append(model_time)
+            self.prompt_tokens.append(prompt_tokens)
+            self.completion_tokens.append(completion_tokens)
+
+    def record_hit(self):
+        with self.lock:
+            self.cache_hits += 1
+
+    def record_cancel(self):
+        with self.lock:
+            self.cancelled += 1
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return {"avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        ordered = sorted(samples)
+        return {
+            "avg": sum(ordered) / len(ordered),
+            "p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "max": ordered[-1],
+        }
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "cache_hits": self.cache_hits,
+                "cancelled": self.cancelled,
+                "queue_wait": self._summary(self.queue_wait),
+                "model_time": self._summary(self.model_time),
+                "prompt_tokens": self._summary(self.prompt_tokens),
+                "completion_tokens": self._summary(self.completion_tokens),
+            }
+
+class OllamaPool:
+    def __init__(self, model, max_concurrency=2, keep_alive="30m", cache=None, base_url=None):
+        self.limiter = ConcurrencyLimiter(max_concurrency)
+        limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        # Le cache des réponses est géré par le pool (avant la file d'attente), pas par ChatOllama
+        self.cache = cache
+        self.llm = ChatOllama(
+            model=model,
+            temperature=0,
+            keep_alive=keep_alive,
+            cache=False,
+            base_url=base_url,
+            client_kwargs={"limits": limits},
+        )
+        self.chain_stats = {}
+
+    # Modèle d'une chaîne : format de sortie ("json" ou None pour du texte), utilisation du cache des réponses et streaming
+    def chain(self, name, format=None, cache=True, stream=False):
+        kwargs = {}
+        if format:
+            kwargs["format"] = format
+        if stream:
+            kwargs["stream"] = True
+        llm = self.llm.bind(**kwargs) if kwargs else self.llm
+        response_cache = self.cache if cache else None
+        # Paramètres du modèle dans la clé du cache, calculés comme LangChain (modèle, température, format...)
+        llm_string = self.llm._get_llm_string(**kwargs)
+        stats = self.chain_stats.setdefault(name, CallStats())
+
+        def cache_prompt(prompt):
+            return dumps(self.llm._convert_input(prompt).to_messages())
+
+        # Réponse en cache : (clé du prompt, message ou None si absent)
+        def lookup(prompt):
+            if response_cache is None:
+                return None, None
+            key = cache_prompt(prompt)
+            generations = response_cache.lookup(key, llm_string)
+            if not generations:
+                return key, None
+            stats.record_hit()
+            current_span().add(llm_cache_hits=1)
+            return key, generations[0].message
+
+        def update(key, result):
+            if key is not None and result is not None:
+                response_cache.update(key, llm_string, [ChatGeneration(message=result)])
+
+        def prompt_tokens(prompt):
+            return count_tokens(prompt.to_string() if hasattr(prompt, "to_string") else str(prompt))
+
+        # Tokens de la réponse : compteur d'Ollama s'il est fourni, sinon estimation tiktoken
+        def completion_tokens(result):
+            usage = getattr(result, "usage_metadata", None) or {}
+            if usage.get("output_tokens") is not None:
+                return usage["output_tokens"]
+            return count_tokens(str(getattr(result, "content", result)))
+
+        def record(queued, started, tokens, result):
+            completion = completion_tokens(result) if result is not None else 0
+            stats.record(started - queued, time.perf_counter() - started, tokens, completion, error=result is None)
+            current_span().add(llm_calls=1, prompt_tokens=tokens, completion_tokens=completion)
+
+        def call(prompt, config):
+            key, message = lookup(prompt)
+            if message is not None:
+                return message
+            tokens = prompt_tokens(prompt)
+            queued = time.perf_counter()
+            self.limiter.acquire()
+            started = time.perf_counter()
+            result = None
+            try:
+                result = llm.invoke(prompt, config)
+            finally:
+                self.limiter.release()
+                record(queued, started, tokens, result)
+            update(key, result)
+            return result
+
+        async def acall(prompt, config):
+            key, message = await asyncio.to_thread(lookup, prompt) if response_cache is not None else (None, None)
+            if message is not None:
+                return message
+            tokens = prompt_tokens(prompt)
+            queued = time.perf_counter()
+            await self.limiter.aacquire()
+            started = time.perf_counter()
+            result, cancelled = None, False
+            try:
+                result = await llm.ainvoke(prompt, config)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                self.limiter.release()
+                if cancelled:
+                    stats.record_cancel()
+                else:
+                    record(queued, started, tokens, result)
+            await asyncio.to_thread(update, key, result)
+            return result
+
+        return RunnableLambda(call, afunc=acall, name=name)
+
+    def stats(self):
+        return {
+            "active": self.limiter.active,
+            "queued": len(self.limiter),
+            "max_concurrency": self.limiter.max_concurrency,
+            "chains": {name: stats.stats() for name, stats in self.chain_stats.items()},
+        }
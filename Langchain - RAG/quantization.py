@@ -0,0 +1,219 @@
+import numpy as np
+
+import os
+import json
+import time
+
+from vectorStore import SEARCH_BLOCK_SIZE, NpyAppender, save_npy, normalize, top_k, group_sums
+
+'''
+   Quantification des embeddings du VectorStore natif pour réduire la mémoire du serveur.
+
+   Deux modes sont disponibles (QUANTIZATION dans generateStore) :
+       - "int8" : quantification scalaire, un octet par dimension (4x moins de mémoire que float32)
+       - "pq"   : quantification produit, le vecteur est découpé en PQ_SUBVECTORS sous-vecteurs codés chacun
+                  sur un octet (384 dimensions, 96 sous-vecteurs : 16x moins de mémoire)
+
+   À la recherche, la question n'est pas quantifiée (calcul de distance asymétrique). Les meilleurs candidats peuvent
+   être re-classés avec les embeddings exacts de embeddings.npy, dont seules les lignes concernées sont lues.
+
+   Les codes sont rattachés à une base par son build_id, launchRag les détecte automatiquement.
+
+   Auteur : Cyril Bouvart
+'''
+
+QUANT_META_FILE = "quant.json"
+QUANT_CODES_FILE = "quant_codes.npy"
+QUANT_PARAMS_FILE = "quant_params.npy"
+QUANT_FILES = (QUANT_META_FILE, QUANT_CODES_FILE, QUANT_PARAMS_FILE)  # Métadonnées en premier
+
+# Nombre de vecteurs utilisés pour apprendre les dictionnaires PQ (environ 64 par centre)
+PQ_TRAINING_SIZE = 16384
+
+active_log = True # Activer/désactiver l'affichage des logs
+
+def log(message):
+    if active_log:
+        print(message)
+
+# Échantillon normalisé de la base pour l'apprentissage des paramètres
+def _training_sample(store, sample_size, seed):
+    rng = np.random.default_rng(seed)
+    ids = np.sort(rng.choice(len(store), size=min(sample_size, len(store)), replace=False))
+    rows = np.asarray(store.embeddings[ids], dtype=np.float32)
+    return rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+# Parcours de la base par blocs normalisés
+def _iter_blocks(store):
+    for start in range(0, len(store), SEARCH_BLOCK_SIZE):
+        rows = np.asarray(store.embeddings[start:start + SEARCH_BLOCK_SIZE], dtype=np.float32)
+        yield rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+# Quantification scalaire : chaque dimension est ramenée sur 256 niveaux entre ses bornes
+class ScalarQuantizer:
+    kind = "int8"
+
+    def __init__(self, low, scale):
+        self.low = low
+        self.scale = scale
+
+    @classmethod
+    def train(cls, sample):
+        low = np.percentile(sample, 0.1, axis=0).astype(np.float32)
+        high = np.percentile(sample, 99.9, axis=0).astype(np.float32)
+        return cls(low, np.maximum(high - low, 1e-6) / 255.0)
+
+    def encode(self, rows):
+        codes = np.rint((rows - self.low) / self.scale) - 128
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    # Scores approchés q.x avec x ~ low + (code + 128) * scale
+    def adc_scores(self, codes, query):
+        weights = query * self.scale
+        offset = float(query @ self.low) + 128.0 * float(weights.sum())
+        return np.asarray(codes, dtype=np.float32) @ weights + offset
+
+    def params(self):
+        return np.stack([self.low, self.scale])
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(params[0], params[1])
+
+# Quantification produit : un dictionnaire de 256 centres par sous-vecteur
+class ProductQuantizer:
+    kind = "pq"
+
+    def __init__(self, codebooks):
+        self.codebooks = codebooks  # (sous-vecteurs, 256, dimension du sous-vecteur)
+
+    @classmethod
+    def train(cls, sample, subvectors, iterations=10, seed=0):
+        dimension = sample.shape[1]
+        if dimension % subvectors != 0:
+            raise ValueError(f"{subvectors} sous-vecteurs incompatibles avec la dimension {dimension}")
+        width = dimension // subvectors
+        centers = min(256, len(sample))
+        rng = np.random.default_rng(seed)
+
+        codebooks = np.empty((subvectors, centers, width), dtype=np.float32)
+        for m in range(subvectors):
+            part = np.ascontiguousarray(sample[:, m * width:(m + 1) * width])
+            codebook = part[rng.choice(len(part), size=centers, replace=False)].copy()
+            for _ in range(iterations):
+                sums, counts = group_sums(part, cls._nearest(part, codebook), centers)
+                filled = counts > 0
+                codebook[filled] = sums[filled] / counts[filled, None]
+            codebooks[m] = codebook
+        return cls(codebooks)
+
+    @staticmethod
+    def _nearest(part, codebook):
+        # ||x||² est identique pour tous les centres : inutile pour l'argmin
+        return np.argmin((codebook ** 2).sum(axis=1) - 2 * part @ codebook.T, axis=1)
+
+    def encode(self, rows):
+        subvectors, _, width = self.codebooks.shape
+        codes = np.empty((len(rows), subvectors), dtype=np.uint8)
+        for m in range(subvectors):
+            codes[:, m] = self._nearest(rows[:, m * width:(m + 1) * width], self.codebooks[m])
+        return codes
+
+    # Scores approchés : somme des produits scalaires sous-vecteur / centre, lus dans une table calculée par question
+    def adc_scores(self, codes, query):
+        subvectors, _, width = self.codebooks.shape
+        table = np.einsum("mcw,mw->mc", self.codebooks, query.reshape(subvectors, width))
+        return table[np.arange(subvectors), np.asarray(codes)].sum(axis=1, dtype=np.float32)
+
+    def params(self):
+        return self.codebooks
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(params)
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+
+# Recherche sur les codes quantifiés, avec re-classement exact optionnel des meilleurs candidats
+class QuantizedSearcher:
+    def __init__(self, store, quantizer, codes, rerank=4):
+        self.store = store
+        self.quantizer = quantizer
+        self.codes = codes
+        self.rerank = rerank  # Facteur de candidats re-classés (k * rerank), 0 pour désactiver
+
+    def _finish(self, ids, scores, query, k):
+        if self.rerank:
+            ids, _ = top_k(ids, scores, k * self.rerank, ordered=False)
+            return self.store.search_rows(np.sort(ids), query, k)
+        return top_k(ids, scores, k)
+
+    def search(self, query, k):
+        query = normalize(query)
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        limit = k * max(self.rerank, 1)
+        for start in range(0, len(self.codes), SEARCH_BLOCK_SIZE):
+            scores = self.quantizer.adc_scores(self.codes[start:start + SEARCH_BLOCK_SIZE], query)
+            best_ids = np.concatenate([best_ids, np.arange(start, start + len(scores))])
+            best_scores = np.concatenate([best_scores, scores.astype(np.float32)])
+            best_ids, best_scores = top_k(best_ids, best_scores, limit, ordered=False)
+        return self._finish(best_ids, best_scores, query, k)
+
+    # Recherche parmi des candidats (indices croissants), utilisée par l'index IVF
+    def search_rows(self, candidates, query, k):
+        candidates = np.asarray(candidates, dtype=np.int64)
+        scores = self.quantizer.adc_scores(self.codes[candidates], query).astype(np.float32)
+        return self._finish(candidates, scores, query, k)
+
+# Apprentissage, encodage par blocs et sauvegarde des codes de la base, par défaut dans son dossier
+def build_quantization(store, kind, directory=None, subvectors=96, sample_size=65536, seed=0):
+    directory = store.directory if directory is None else directory
+    start = time.perf_counter()
+    if kind == "int8":
+        quantizer = ScalarQuantizer.train(_training_sample(store, sample_size, seed))
+    elif kind == "pq":
+        quantizer = ProductQuantizer.train(_training_sample(store, min(sample_size, PQ_TRAINING_SIZE), seed), subvectors, seed=seed)
+    else:
+        raise ValueError(f"Quantification inconnue : {kind}")
+
+    tmp_path = os.path.join(directory, QUANT_CODES_FILE + ".tmp")
+    codes = NpyAppender(tmp_path, np.int8 if kind == "int8" else np.uint8)
+    for rows in _iter_blocks(store):
+        codes.append(quantizer.encode(rows))
+    codes.close()
+    os.replace(tmp_path, os.path.join(directory, QUANT_CODES_FILE))
+    save_npy(os.path.join(directory, QUANT_PARAMS_FILE), quantizer.params())
+
+    code_bytes = codes.count * int(np.prod(codes.row_shape))
+    float_bytes = codes.count * store.embeddings.shape[1] * 4
+    meta = {
+        "type": kind,
+        "store_build_id": store.meta.get("build_id"),
+        "bytes": code_bytes,
+        "compression": round(float_bytes / max(code_bytes, 1), 1),
+    }
+    tmp_meta = os.path.join(directory, QUANT_META_FILE + ".tmp")
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_meta, os.path.join(directory, QUANT_META_FILE))
+
+    log(f"  🗜️ Quantification {kind} en {time.perf_counter() - start:.1f}s ({meta['compression']}x moins que float32)")
+    return meta
+
+# Chargement des codes de la base, None si absents ou obsolètes
+def load_quantization(store, directory=None, rerank=4):
+    directory = store.directory if directory is None else directory
+    meta_path = os.path.join(directory, QUANT_META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("store_build_id") != store.meta.get("build_id"):
+        log("⚠️ Quantification obsolète, embeddings exacts utilisés (relancez generateStore).")
+        return None
+
+    quantizer = QUANTIZERS[meta["type"]].from_params(np.load(os.path.join(directory, QUANT_PARAMS_FILE)))
+    codes = np.load(os.path.join(directory, QUANT_CODES_FILE), mmap_mode="r")
+    return QuantizedSearcher(store, quantizer, codes, rerank=rerank)
@@ -0,0 +1,69 @@
+import numpy as np
+
+'''
+   Pré-filtre de pertinence local (CPU) des documents récupérés, avant la notation par le LLM.
+
+   Chaque document reçoit un verdict :
+       - "oui" : pertinent sans appel au LLM (similarité cosinus au-dessus de accept)
+       - "non" : non pertinent sans appel au LLM (similarité sous reject)
+       - None  : cas limite, noté par le retrieval_grader
+
+   Un cross-encoder optionnel (sentence_transformers.CrossEncoder, ex : "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+   multilingue) peut trancher les cas limites par lots, avec ses propres seuils sur son score. Les seuils se choisissent
+   avec calibrateFilter.py (appels au LLM évités / désaccords avec le retrieval_grader).
+
+   La similarité est lue dans metadata["similarity"], renseignée par StoreRetriever. Les documents trouvés par le
+   classement BM25 (metadata["lexical"] : identifiants exacts, souvent peu similaires à la question) ne sont jamais
+   écartés sur la seule similarité cosinus.
+
+   Auteur : Cyril Bouvart
+'''
+
+class RelevanceFilter:
+    def __init__(self, accept=0.75, reject=0.25, cross_encoder=None, cross_accept=3.0, cross_reject=-3.0, batch_size=32):
+        self.accept = accept  # Similarité cosinus minimale pour « oui », None pour désactiver
+        self.reject = reject  # Similarité cosinus maximale pour « non », None pour désactiver
+        self.cross_encoder = cross_encoder  # Nom du modèle cross-encoder, None pour ne pas l'utiliser
+        self.cross_accept = cross_accept
+        self.cross_reject = cross_reject
+        self.batch_size = batch_size
+        self._model = None
+
+    def load_cross_encoder(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            self._model = CrossEncoder(self.cross_encoder, device="cpu")
+        return self._model
+
+    @staticmethod
+    def _threshold_verdict(score, accept, reject):
+        if score is None:
+            return None
+        if accept is not None and score >= accept:
+            return "oui"
+        if reject is not None and score <= reject:
+            return "non"
+        return None
+
+    # Scores du cross-encoder pour les documents donnés (calculés par lots)
+    def cross_scores(self, question, documents):
+        if not documents:
+            return np.empty(0, dtype=np.float32)
+        pairs = [(question, d.page_content) for d in documents]
+        return np.asarray(self.load_cross_encoder().predict(pairs, batch_size=self.batch_size), dtype=np.float32).ravel()
+
+    # Verdict de chaque document : "oui", "non" ou None (à noter par le LLM)
+    def verdicts(self, question, documents):
+        verdicts = [
+            self._threshold_verdict(
+                d.metadata.get("similarity"), self.accept, None if d.metadata.get("lexical") else self.reject
+            )
+            for d in documents
+        ]
+        if self.cross_encoder:
+            borderline = [i for i, verdict in enumerate(verdicts) if verdict is None]
+            scores = self.cross_scores(question, [documents[i] for i in borderline])
+            for i, score in zip(borderline, scores):
+                verdicts[i] = self._threshold_verdict(float(score), self.cross_accept, self.cross_reject)
+        return verdicts
@@ -6,6 +6,11 @@ import time
    Exemple d'un client interrogeant l'API Flask.
 '''
 
+# Réception de la réponse : "sse" (poussée par le serveur dès la fin du traitement) ou "long-poll"
+MODE = "sse"
+STREAM = True  # Avec "sse" : affichage de la réponse au fil de la génération, puis de son verdict
+LONG_POLL_WAIT = 30  # Durée maximale de chaque requête long-poll en secondes
+
 # Identifiant unique du client
 client_id = "user_123"
 
@@ -19,29 +24,72 @@ data = {
 }
 response = requests.post("http://localhost:5000/ask", json=data)
 
+# File d'attente du serveur pleine : nouvel essai après le délai indiqué par Retry-After
+while response.status_code in (429, 503):
+    retry_after = int(response.headers.get("Retry-After", 5))
+    print(f"⏳ Serveur occupé, nouvel essai dans {retry_after}s...")
+    time.sleep(retry_after)
+    response = requests.post("http://localhost:5000/ask", json=data)
+
+# Affichage d'un état renvoyé par le serveur, True si la réponse est arrivée
+def show_status(status_data):
+    if status_data["status"] == "completed":
+        print("📩 Réponse reçue :", status_data["response"])
+        return True
+    elif status_data["status"] == "error":
+        print("❌ Erreur :", status_data["response"])
+        return True
+    elif status_data.get("position"):
+        print(f"⏳ Position dans la file d'attente : {status_data['position']}")
+    return False
+
+# Server-Sent Events : le serveur envoie la position dans la file, les tokens de la réponse (STREAM) puis le résultat,
+# sur une seule connexion
+def wait_sse(question_id):
+    params = {"stream": 1} if STREAM else {}
+    with requests.get(f"http://localhost:5000/events/{question_id}", params=params, stream=True) as events:
+        if events.status_code == 404:
+            print("❌ Question ID inconnu ou expiré")
+            return
+        event, answer = None, None  # answer : dernière réponse validée affichée en streaming
+        for line in events.iter_lines(decode_unicode=True):
+            if line and line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line and line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "token":
+                    if answer is None:
+                        print("📩 Réponse (en cours de vérification) : ", end="")
+                        answer = ""
+                    answer += data["text"]
+                    print(data["text"], end="", flush=True)
+                elif event == "validation":
+                    print()
+                    if data["valid"]:
+                        print("✅ Réponse validée")
+                    else:
+                        print("❌ Réponse rejetée, nouvelle tentative...")
+                        answer = None
+                elif event == "result" and answer is not None and data.get("response") == answer:
+                    return  # Réponse déjà affichée
+                elif show_status(data):
+                    return
+
+# Long-poll : chaque requête n'est renvoyée qu'à la fin du traitement ou après LONG_POLL_WAIT secondes
+def wait_long_poll(question_id):
+    while True:
+        status_response = requests.get(f"http://localhost:5000/status/{question_id}", params={"wait": LONG_POLL_WAIT})
+        if status_response.status_code == 404:
+            print("❌ Question ID inconnu ou expiré")
+            return
+        if show_status(status_response.json()):
+            return
+
 if response.status_code == 202:
     question_id = response.json().get("question_id")
     print(f"✅ Question envoyée (ID: {question_id}) : En attente de réponse...")
 
-    # Attente active de la réponse
-    timeout = 10  # Temps max d'attente en secondes
-    start_time = time.time()
-
-    while True: # Pour ajouter un timeout : (time.time() - start_time) < timeout
-        time.sleep(5)  # Polling toutes les 5 secondes
-        status_response = requests.get(f"http://localhost:5000/status/{question_id}")
-
-        if status_response.status_code == 200:
-            status_data = status_response.json()
-            if status_data["status"] == "completed":
-                print("📩 Réponse reçue :", status_data["response"])
-                break
-            elif status_data["status"] == "error":
-                print("❌ Erreur :", status_data["response"])
-                break
-        elif status_response.status_code == 404:
-            print("❌ Question ID inconnu ou expiré")
-            break
-
+    if MODE == "sse":
+        wait_sse(question_id)
     else:
-        print("❌ Temps d'attente dépassé, aucune réponse reçue.")
\ No newline at end of file
+        wait_long_poll(question_id)
@@ -0,0 +1,270 @@
+import os
+import json
+import asyncio
+import time
+import uuid
+import inspect
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+'''
+   Traces et métriques du pipeline self-RAG.
+
+   Chaque question traitée par rag_pipeline produit une trace, composée d'un span par étape (retrieve, grade, rewrite,
+   generate, validate...) avec sa durée, le numéro de la tentative et les attributs renseignés par l'étape (documents
+   récupérés / retenus, tokens du prompt et de la réponse, succès de cache). La trace note aussi le délai avant le
+   premier token généré (time to first token). Le span courant est porté par une
+   ContextVar : il suit les tâches asyncio et les threads lancés avec copy_context().
+
+   Les traces terminées alimentent :
+       - des métriques agrégées, exportées au format texte Prometheus (route /metrics de app.py)
+       - un fichier JSON lines optionnel (une trace par ligne)
+
+   Auteur : Cyril Bouvart
+'''
+
+# Bornes des histogrammes de durée (secondes) et du nombre de tentatives
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ATTEMPT_BUCKETS = (1, 2, 3, 5)
+
+_current_trace = contextvars.ContextVar("rag_trace", default=None)
+_current_span = contextvars.ContextVar("rag_span", default=None)
+
+class Span:
+    def __init__(self, name, attempt=None, parent=None):
+        self.name = name
+        self.attempt = attempt
+        self.parent = parent
+        self.start = time.time()
+        self.duration = None
+        self.attributes = {}
+        self.lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self.lock:
+            self.attributes.update(attributes)
+
+    # Cumul d'attributs numériques (tokens des appels au LLM faits pendant l'étape)
+    def add(self, **attributes):
+        with self.lock:
+            for key, value in attributes.items():
+                self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self, origin):
+        with self.lock:
+            return {
+                "name": self.name,
+                "attempt": self.attempt,
+                "parent": self.parent,
+                "start": round(self.start - origin, 6),
+                "duration": round(self.duration or 0.0, 6),
+                **self.attributes,
+            }
+
+# Span sans effet, renvoyé quand aucune trace n'est en cours
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def add(self, **attributes):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Trace:
+    def __init__(self, question):
+        self.id = uuid.uuid4().hex
+        self.question = question
+        self.start = time.time()
+        self.duration = None
+        self.attempt = 1
+        self.outcome = None
+        self.time_to_first_token = None  # Secondes entre le début de la trace et le premier token généré
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_span(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    # Premier token généré (toutes tentatives confondues), seul le premier appel est retenu
+    def first_token(self):
+        with self.lock:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.time() - self.start
+
+    def to_dict(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.id,
+            "question": self.question,
+            "outcome": self.outcome,
+            "attempts": self.attempt,
+            "duration": round(self.duration or 0.0, 6),
+            "time_to_first_token": None if self.time_to_first_token is None else round(self.time_to_first_token, 6),
+            "spans": [span.to_dict(self.start) for span in spans],
+        }
+
+def current_span():
+    return _current_span.get() or _NULL_SPAN
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def span(name):
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    parent = _current_span.get()
+    current = Span(name, attempt=trace.attempt, parent=parent.name if parent else None)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        trace.add_span(current)
+
+# Décorateur : la fonction (synchrone ou coroutine) s'exécute dans un span
+def traced(name):
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Métriques agrégées au format Prometheus (compteurs et histogrammes avec étiquettes)
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # nom -> {étiquettes: valeur}
+        self.histograms = {}  # nom -> (bornes, {étiquettes: [compteurs par borne, somme, total]})
+        self.help = {}
+
+    def inc(self, name, labels=(), value=1, help=""):
+        with self.lock:
+            self.help.setdefault(name, help)
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, value, labels=(), buckets=DURATION_BUCKETS, help=""):
+        with self.lock:
+            self.help.setdefault(name, help)
+            bounds, series = self.histograms.setdefault(name, (buckets, {}))
+            counts = series.setdefault(labels, [[0] * len(bounds), 0.0, 0])
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    # Agrégation d'une trace terminée
+    def record_trace(self, trace):
+        self.inc("rag_requests_total", (("outcome", trace.outcome),), help="Questions traitées par résultat")
+        self.observe("rag_request_duration_seconds", trace.duration, help="Durée de traitement d'une question")
+        self.observe("rag_attempts", trace.attempt, buckets=ATTEMPT_BUCKETS, help="Tentatives par question")
+        if trace.time_to_first_token is not None:
+            self.observe("rag_time_to_first_token_seconds", trace.time_to_first_token, help="Délai avant le premier token de la réponse")
+        with trace.lock:
+            spans = list(trace.spans)
+        for current in spans:
+            labels = (("stage", current.name),)
+            self.observe("rag_stage_duration_seconds", current.duration or 0.0, labels, help="Durée des étapes du pipeline")
+            for key, value in current.attributes.items():
+                if not isinstance(value, (int, float)):
+                    continue  # Les booléens (hit, valid) sont comptés comme 0 / 1
+                self.inc(f"rag_stage_{key}_total", labels, value, help=f"Cumul de {key} par étape")
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {self.help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for name, (bounds, series) in sorted(self.histograms.items()):
+                lines.append(f"# HELP {name} {self.help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, (counts, total, count) in series.items():
+                    for bound, bucket in zip(bounds, counts):
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {bucket}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+# Jauges Prometheus à partir d'un dictionnaire de statistiques imbriqué (rag_stats) : rag_<chemin>
+def render_gauges(stats, prefix="rag"):
+    lines = []
+
+    def walk(value, name):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                walk(child, f"{name}_{key}")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+    walk(stats, prefix)
+    return "\n".join(lines) + "\n" if lines else ""
+
+class Tracer:
+    def __init__(self, trace_file=None):
+        self.trace_file = trace_file  # Fichier JSON lines des traces, None pour ne pas les écrire
+        self.metrics = Metrics()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, question):
+        current = Trace(question)
+        token = _current_trace.set(current)
+        started = time.perf_counter()
+        try:
+            yield current
+        except asyncio.CancelledError:
+            current.outcome = "cancelled"
+            raise
+        except TimeoutError:
+            current.outcome = "timeout"
+            raise
+        except BaseException:
+            current.outcome = "error"
+            raise
+        finally:
+            current.duration = time.perf_counter() - started
+            _current_trace.reset(token)
+            self.finish(current)
+
+    def finish(self, trace):
+        self.metrics.record_trace(trace)
+        if self.trace_file:
+            line = json.dumps(trace.to_dict(), ensure_ascii=False)
+            with self.lock:
+                os.makedirs(os.path.dirname(self.trace_file) or ".", exist_ok=True)
+                with open(self.trace_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
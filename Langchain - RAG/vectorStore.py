@@ -0,0 +1,562 @@
+import numpy as np
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, PrivateAttr
+
+import os
+import sys
+import json
+import hashlib
+import shutil
+import struct
+import threading
+import time
+import uuid
+
+from caches import normalize_question
+
+'''
+   Format natif du VectorStore, écrit par lots par generateStore et relu par launchRag.
+
+   Chaque construction est une version de la base, dans son propre dossier ./Store/versions/<version>/ :
+       - embeddings.npy : matrice contiguë (nombre de chunks x dimension) des embeddings normalisés, en float32 ou float16
+       - chunks.jsonl   : une ligne JSON par chunk (texte et métadonnées)
+       - offsets.npy    : position de chaque ligne dans chunks.jsonl (accès direct à un chunk)
+       - duplicates.jsonl : métadonnées des chunks dupliqués fusionnés avec un chunk conservé (ligne, métadonnées)
+       - store.json     : description de la base (modèle, dimension, nombre de chunks), écrit en dernier
+       - les fichiers annexes (annIndex, quantization, lexicalIndex) construits pour cette version
+
+   Une version est écrite dans un dossier temporaire (versions/.building-*), renommé une fois complet, puis publiée en
+   remplaçant d'un coup ./Store/current.json qui désigne la version courante. Les fichiers d'une version publiée ne sont
+   jamais modifiés : un serveur qui les a ouverts ou projetés en mémoire continue de les lire (sous Windows, un fichier
+   ouvert ne peut pas être remplacé) et passe à la nouvelle version au rechargement. Les anciennes versions sont
+   supprimées à la publication suivante, celles encore ouvertes par un serveur lors d'une publication ultérieure.
+   Une base de l'ancien format (fichiers directement dans ./Store/) reste lisible et migre à la construction suivante.
+
+   Au démarrage, embeddings.npy est ouvert avec np.memmap : rien n'est copié et plusieurs processus serveur partagent
+   les mêmes pages mémoire. Les textes sont relus à la demande grâce à offsets.npy.
+
+   Conversion d'un ancien VectorStore parquet (SKLearnVectorStore) :
+       python vectorStore.py [./Store/vectorstore.pqt]
+
+   Auteur : Cyril Bouvart
+'''
+
+# Dossier du VectorStore
+STORE_DIR = './Store/'
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.npy"
+DUPLICATES_FILE = "duplicates.jsonl"
+META_FILE = "store.json"
+CURRENT_FILE = "current.json"
+VERSIONS_DIR = "versions"
+
+# Fichiers de la base elle-même, communs à toutes les configurations des fichiers annexes
+STORE_FILES = (EMBEDDINGS_FILE, CHUNKS_FILE, OFFSETS_FILE, DUPLICATES_FILE, META_FILE)
+
+STORE_FORMAT = 2
+
+# Nombre de lignes de la matrice traitées à la fois lors d'une recherche exacte
+SEARCH_BLOCK_SIZE = 65536
+
+# Taille fixe de l'en-tête .npy pour pouvoir le réécrire une fois le nombre de lignes connu
+NPY_HEADER_SIZE = 128
+
+# Dossier de la version courante de la base (désignée par current.json), le dossier lui-même s'il contient une base
+# de l'ancien format ou une version, None s'il n'y a pas de base
+def current_store_dir(directory=STORE_DIR):
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), "r", encoding="utf-8") as f:
+            version_dir = os.path.join(directory, VERSIONS_DIR, json.load(f)["version"])
+    except FileNotFoundError:
+        version_dir = directory
+    return version_dir if os.path.exists(os.path.join(version_dir, META_FILE)) else None
+
+def store_exists(directory=STORE_DIR):
+    return current_store_dir(directory) is not None
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+# Signature de la version courante, modifiée à chaque publication : (dossier de la version, signature de store.json)
+def store_signature(directory=STORE_DIR):
+    version_dir = current_store_dir(directory)
+    if version_dir is None:
+        return None
+    return version_dir, _file_signature(os.path.join(version_dir, META_FILE))
+
+# Dossier temporaire d'une nouvelle version, renommé à la publication
+def new_version_dir(directory=STORE_DIR):
+    version_dir = os.path.join(directory, VERSIONS_DIR, f".building-{uuid.uuid4().hex}")
+    os.makedirs(version_dir)
+    return version_dir
+
+# Nouvelle version reprenant les fichiers names d'une version existante (liens physiques, copie si impossible), pour
+# reconstruire des fichiers annexes sans toucher à la version publiée
+def fork_store(source_dir, names, directory=STORE_DIR):
+    version_dir = new_version_dir(directory)
+    for name in names:
+        source = os.path.join(source_dir, name)
+        if not os.path.exists(source):
+            continue
+        try:
+            os.link(source, os.path.join(version_dir, name))
+        except OSError:
+            shutil.copy2(source, os.path.join(version_dir, name))
+    return version_dir
+
+# Suppression d'un dossier de version, sans erreur pour les fichiers encore ouverts par un serveur (Windows) : ils
+# seront supprimés à la publication suivante
+def remove_version_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+
+# Publication d'une version complète (dossier temporaire de new_version_dir ou fork_store) : renommage, remplacement de
+# current.json en une fois puis suppression des anciennes versions. Retourne le dossier de la version publiée.
+def publish_store(version_dir, directory=STORE_DIR):
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    published = os.path.join(directory, VERSIONS_DIR, name)
+    os.rename(version_dir, published)
+
+    tmp_path = os.path.join(directory, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": name}, f)
+    for attempt in range(10):
+        try:
+            os.replace(tmp_path, os.path.join(directory, CURRENT_FILE))
+            break
+        except PermissionError:
+            # Windows : current.json est en cours de lecture par un serveur
+            if attempt == 9:
+                raise
+            time.sleep(0.1)
+
+    # Base de l'ancien format directement dans le dossier : store.json en premier
+    for legacy in (META_FILE,) + tuple(sorted(os.listdir(published))):
+        path = os.path.join(directory, legacy)
+        if os.path.isfile(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    for entry in os.listdir(os.path.join(directory, VERSIONS_DIR)):
+        if entry != name and not entry.startswith(".building-"):
+            remove_version_dir(os.path.join(directory, VERSIONS_DIR, entry))
+    return published
+
+# Suppression de la base : current.json en premier, le dossier ne contient plus de base valide dès cet instant
+def remove_store(directory=STORE_DIR):
+    for path in (os.path.join(directory, CURRENT_FILE), os.path.join(directory, META_FILE)):
+        if os.path.exists(path):
+            os.remove(path)
+    for name in STORE_FILES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    versions = os.path.join(directory, VERSIONS_DIR)
+    if os.path.isdir(versions):
+        for entry in os.listdir(versions):
+            if not entry.startswith(".building-"):
+                remove_version_dir(os.path.join(versions, entry))
+
+# Normalisation d'un vecteur de question
+def normalize(query):
+    query = np.asarray(query, dtype=np.float32)
+    return query / max(float(np.linalg.norm(query)), 1e-12)
+
+# Fusion de classements (listes d'indices triées) par Reciprocal Rank Fusion : les k meilleurs indices
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    scores = {}
+    for ranking in rankings:
+        for rank, index in enumerate(ranking):
+            scores[int(index)] = scores.get(int(index), 0.0) + 1.0 / (rrf_k + rank + 1)
+    return np.array(sorted(scores, key=lambda index: -scores[index])[:k], dtype=np.int64)
+
+# Somme des lignes par groupe (k-means) : (sommes, effectifs)
+def group_sums(rows, assignment, groups):
+    order = np.argsort(assignment, kind="stable")
+    counts = np.bincount(assignment, minlength=groups)
+    sums = np.zeros((groups, rows.shape[1]), dtype=np.float32)
+    filled = np.flatnonzero(counts)
+    if len(filled):
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        sums[filled] = np.add.reduceat(rows[order], starts, axis=0)
+    return sums, counts
+
+# Sélection des k meilleurs scores : (indices, scores), triés par score décroissant si ordered
+def top_k(ids, scores, k, ordered=True):
+    if len(scores) > k:
+        top = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[top], scores[top]
+    if ordered:
+        order = np.argsort(-scores, kind="stable")
+        ids, scores = ids[order], scores[order]
+    return ids, scores
+
+# Écriture d'un .npy dans un fichier temporaire renommé une fois complet : un fichier interrompu n'est jamais pris pour
+# un fichier valide
+def save_npy(path, array):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+# En-tête .npy (version 1.0) complété par des espaces jusqu'à NPY_HEADER_SIZE octets
+def _npy_header(dtype, shape):
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }" % (np.dtype(dtype).str, repr(tuple(shape)))
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+# Fichier .npy alimenté ligne à ligne, sans garder les données en mémoire
+class NpyAppender:
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = None
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * NPY_HEADER_SIZE)  # Réservé pour l'en-tête
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if self.row_shape is None:
+            self.row_shape = rows.shape[1:]
+        elif rows.shape[1:] != self.row_shape:
+            raise ValueError(f"Dimension incohérente : {rows.shape[1:]} au lieu de {self.row_shape}")
+        self.file.write(rows.tobytes())
+        self.count += rows.shape[0]
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, (self.count,) + tuple(self.row_shape or ())))
+        self.file.close()
+
+# Écriture d'un VectorStore par lots successifs
+class StoreWriter:
+    def __init__(self, directory=STORE_DIR, model_name=None, dtype="float32"):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Type d'embedding non supporté : {dtype}")
+        self.directory = directory
+        self.model_name = model_name
+        self.dtype = dtype
+        self.version_dir = new_version_dir(directory)  # Publié par publish_store une fois la base et ses annexes écrites
+
+        self.embeddings = NpyAppender(os.path.join(self.version_dir, EMBEDDINGS_FILE), dtype)
+        self.offsets = NpyAppender(os.path.join(self.version_dir, OFFSETS_FILE), np.uint64)
+        self.chunks = open(os.path.join(self.version_dir, CHUNKS_FILE), "wb")
+        self.duplicates = open(os.path.join(self.version_dir, DUPLICATES_FILE), "w", encoding="utf-8")
+        self.duplicate_count = 0
+        self.position = 0
+
+    # Ajout d'un lot : embeddings (n x dimension), textes et métadonnées.
+    # Les embeddings sont normalisés : la similarité cosinus devient un simple produit scalaire.
+    def append(self, embeddings, texts, metadatas):
+        if len(texts) != len(embeddings) or len(metadatas) != len(embeddings):
+            raise ValueError("Les embeddings, textes et métadonnées doivent avoir la même longueur")
+        if len(texts) == 0:
+            return
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+
+        offsets = np.empty(len(texts), dtype=np.uint64)
+        for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+            line = json.dumps({"text": text, "metadata": metadata}, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+            offsets[i] = self.position
+            self.chunks.write(line)
+            self.position += len(line)
+
+        self.embeddings.append(embeddings)
+        self.offsets.append(offsets)
+
+    # Rattachement des métadonnées d'un chunk dupliqué à la ligne conservée
+    def add_duplicate(self, row, metadata):
+        self.duplicates.write(json.dumps({"row": int(row), "metadata": metadata}, ensure_ascii=False, default=str) + "\n")
+        self.duplicate_count += 1
+
+    @property
+    def count(self):
+        return self.embeddings.count
+
+    # Finalisation de la version : store.json est écrit en dernier, la version reste à publier (publish_store)
+    def close(self):
+        self.offsets.append(np.array([self.position], dtype=np.uint64))  # Fin du dernier chunk
+        self.chunks.close()
+        self.duplicates.close()
+        self.embeddings.close()
+        self.offsets.close()
+
+        dimension = int(self.embeddings.row_shape[0]) if self.embeddings.row_shape else 0
+        meta = {
+            "format": STORE_FORMAT,
+            "model": self.model_name,
+            "count": self.count,
+            "duplicates": self.duplicate_count,
+            "dimension": dimension,
+            "dtype": self.dtype,
+            "normalized": True,
+            "build_id": uuid.uuid4().hex,
+            "created": time.time(),
+        }
+        with open(os.path.join(self.version_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+    # Abandon de la construction (avant ou après close) : la version publiée est conservée
+    def abort(self):
+        for handle in (self.chunks, self.duplicates, self.embeddings.file, self.offsets.file):
+            handle.close()
+        remove_version_dir(self.version_dir)
+
+# Lecture d'un VectorStore : les embeddings sont projetés en mémoire (np.memmap), les chunks lus à la demande
+class StoreReader:
+    def __init__(self, directory=STORE_DIR):
+        self.root = directory  # Dossier de la base, surveillé par StoreRetriever.refresh
+        self.signature = store_signature(directory)
+        if self.signature is None:
+            raise FileNotFoundError(f"Aucune base dans {directory}")
+        self.directory = self.signature[0]  # Dossier de la version ouverte
+        directory = self.directory
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r")
+        self.chunks_path = os.path.join(directory, CHUNKS_FILE)
+        # Fichiers ouverts dès le chargement : les lectures restent sur cette version même si elle est supprimée après la
+        # publication d'une autre
+        self.chunks_file = open(self.chunks_path, "rb")
+        self.chunks_lock = threading.Lock()  # Position de lecture partagée entre les threads
+        duplicates_path = os.path.join(directory, DUPLICATES_FILE)
+        self.duplicates_file = open(duplicates_path, "rb") if os.path.exists(duplicates_path) else None
+        self._duplicates = None
+
+        # Bases au format 1 : embeddings non normalisés, les normes sont calculées une fois
+        self.norms = None
+        if not self.meta.get("normalized", False):
+            self.norms = np.empty(len(self), dtype=np.float32)
+            for start in range(0, len(self), SEARCH_BLOCK_SIZE):
+                block = np.asarray(self.embeddings[start:start + SEARCH_BLOCK_SIZE], dtype=np.float32)
+                self.norms[start:start + len(block)] = np.maximum(np.linalg.norm(block, axis=1), 1e-12)
+
+    def __len__(self):
+        return int(self.embeddings.shape[0])
+
+    # Libère les projections mémoire et les fichiers ouverts (nécessaire sous Windows avant de remplacer les fichiers)
+    def close(self):
+        self.embeddings = None
+        self.offsets = None
+        for handle in (self.chunks_file, self.duplicates_file):
+            if handle is not None:
+                handle.close()
+
+    # Recherche exacte des k chunks les plus proches (similarité cosinus) : (indices, scores) triés
+    def search(self, query, k):
+        query = normalize(query)
+
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self), SEARCH_BLOCK_SIZE):
+            scores = np.asarray(self.embeddings[start:start + SEARCH_BLOCK_SIZE] @ query, dtype=np.float32)
+            if self.norms is not None:
+                scores /= self.norms[start:start + len(scores)]
+            best_ids = np.concatenate([best_ids, np.arange(start, start + len(scores))])
+            best_scores = np.concatenate([best_scores, scores])
+            best_ids, best_scores = top_k(best_ids, best_scores, k, ordered=False)
+
+        return top_k(best_ids, best_scores, k)
+
+    # Similarité cosinus entre une question normalisée et les chunks d'indices donnés
+    def score_rows(self, indices, query):
+        indices = np.asarray(indices, dtype=np.int64)
+        scores = np.asarray(self.embeddings[indices] @ query, dtype=np.float32)
+        if self.norms is not None:
+            scores /= self.norms[indices]
+        return scores
+
+    # Recherche exacte des k meilleurs chunks parmi des candidats (indices croissants)
+    def search_rows(self, candidates, query, k):
+        return top_k(np.asarray(candidates, dtype=np.int64), self.score_rows(candidates, query), k)
+
+    # Métadonnées des doublons fusionnés, par ligne conservée (chargées à la première utilisation)
+    @property
+    def duplicates(self):
+        if self._duplicates is None:
+            duplicates = {}
+            if self.duplicates_file is not None:
+                with self.chunks_lock:
+                    self.duplicates_file.seek(0)
+                    lines = self.duplicates_file.read().splitlines()
+                for line in lines:
+                    entry = json.loads(line)
+                    duplicates.setdefault(entry["row"], []).append(entry["metadata"])
+            self._duplicates = duplicates
+        return self._duplicates
+
+    # Lecture des chunks d'indices donnés, les métadonnées des doublons sont ajoutées sous la clé "duplicates"
+    def get_chunks(self, indices):
+        duplicates = self.duplicates
+        raw = []
+        with self.chunks_lock:
+            for i in indices:
+                start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+                self.chunks_file.seek(start)
+                raw.append(self.chunks_file.read(end - start))
+        chunks = []
+        for i, data in zip(indices, raw):
+            chunk = json.loads(data)
+            if int(i) in duplicates:
+                chunk["metadata"]["duplicates"] = duplicates[int(i)]
+            chunks.append(chunk)
+        return chunks
+
+    # Parcours séquentiel des chunks par lots : (embeddings, textes, métadonnées)
+    def iter_batches(self, batch_size=1024):
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            with self.chunks_lock:
+                self.chunks_file.seek(int(self.offsets[start]))
+                data = self.chunks_file.read(int(self.offsets[end]) - int(self.offsets[start]))
+            chunks = [json.loads(line) for line in data.splitlines()]
+            yield (
+                self.embeddings[start:end],
+                [chunk["text"] for chunk in chunks],
+                [chunk["metadata"] for chunk in chunks],
+            )
+
+# Retriever LangChain s'appuyant sur un StoreReader
+class StoreRetriever(BaseRetriever):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    store: StoreReader
+    embedding: object  # Embeddings utilisé pour encoder la question
+    k: int = 4
+    index: object = None  # Index approximatif (annIndex), recherche exacte si absent
+    lexical: object = None  # Index BM25 (lexicalIndex) pour la recherche hybride, embeddings seuls si absent
+    hybrid_candidates: int = 20  # Nombre de candidats de chaque classement fusionnés
+    rrf_k: int = 60  # Constante de la Reciprocal Rank Fusion
+    loader: object = None  # Fonction renvoyant (store, index, lexical) pour recharger une base remplacée
+    query_cache: object = None  # LRUCache : question normalisée -> embedding
+    result_cache: object = None  # LRUCache : (build_id, embedding, question, k) -> indices des chunks
+
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _snapshot: tuple = PrivateAttr(default=None)  # (store, index, lexical) de la dernière version chargée
+
+    # Rechargement de la base et vidage des caches si une nouvelle version a été publiée
+    def refresh(self):
+        if self.loader is None or store_signature(self.store.root) in (None, self.store.signature):
+            return False
+        with self._lock:
+            if store_signature(self.store.root) in (None, self.store.signature):
+                return False  # Déjà rechargée par un autre thread
+            self._snapshot = self.loader()  # Remplacés ensemble : une recherche ne mélange pas deux versions
+            self.store, self.index, self.lexical = self._snapshot
+            for cache in (self.query_cache, self.result_cache):
+                if cache is not None:
+                    cache.clear()
+        return True
+
+    # Base, index approximatif et index lexical d'une même version, lus une seule fois par recherche
+    def snapshot(self):
+        snapshot = self._snapshot
+        return snapshot if snapshot is not None else (self.store, self.index, self.lexical)
+
+    def embed_query(self, query):
+        if self.query_cache is None:
+            return np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        key = normalize_question(query)
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            embedding = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+            self.query_cache.put(key, embedding)
+        return embedding
+
+    # Recherche dense, fusionnée avec le classement BM25 si l'index lexical est disponible
+    # (indices des chunks, chunks présents dans le classement BM25)
+    def _search(self, snapshot, query, embedding, k):
+        store, index, lexical_index = snapshot
+        searcher = index if index is not None else store
+        if lexical_index is None:
+            indices = searcher.search(embedding, k)[0]
+            return indices, np.zeros(len(indices), dtype=bool)
+        candidates = max(k, self.hybrid_candidates)
+        dense, _ = searcher.search(embedding, candidates)
+        lexical, _ = lexical_index.search(query, candidates)
+        indices = reciprocal_rank_fusion([dense, lexical], k, rrf_k=self.rrf_k)
+        return indices, np.isin(indices, lexical)
+
+    # Recherche dans une version de la base (snapshot), la version courante par défaut
+    def search(self, query, embedding, k, snapshot=None):
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        if self.result_cache is None:
+            return self._search(snapshot, query, embedding, k)
+        # Les indices ne valent que pour la version de la base qui les a produits : une recherche commencée avant un
+        # rechargement ne peut pas servir ses résultats à la nouvelle version. Le classement BM25 dépend du texte de la
+        # question, pas seulement de son embedding.
+        store, _, lexical_index = snapshot
+        text_key = normalize_question(query) if lexical_index is not None else None
+        key = (store.meta.get("build_id"), hashlib.blake2b(embedding.tobytes(), digest_size=16).digest(), text_key, k)
+        indices = self.result_cache.get(key)
+        if indices is None:
+            indices = self._search(snapshot, query, embedding, k)
+            self.result_cache.put(key, indices)
+        return indices
+
+    def cache_stats(self):
+        return {
+            name: cache.stats()
+            for name, cache in (("query_embeddings", self.query_cache), ("retrieval_results", self.result_cache))
+            if cache is not None
+        }
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        self.refresh()
+        snapshot = self.snapshot()
+        store = snapshot[0]
+        embedding = self.embed_query(query)
+        indices, lexical_hits = self.search(query, embedding, self.k, snapshot)
+        # Similarité cosinus question / chunk et présence dans le classement BM25, utilisées par le pré-filtre de
+        # pertinence (relevanceFilter)
+        similarities = store.score_rows(indices, normalize(embedding))
+        return [
+            Document(
+                page_content=chunk["text"],
+                metadata={**chunk["metadata"], "similarity": float(similarity), "lexical": bool(lexical)},
+            )
+            for chunk, similarity, lexical in zip(store.get_chunks(indices), similarities, lexical_hits)
+        ]
+
+# Conversion d'un VectorStore parquet (SKLearnVectorStore) vers le format natif, par lots
+def convert_parquet_store(parquet_path, directory=STORE_DIR, dtype="float32", model_name="all-MiniLM-L6-v2", batch_size=1024):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(parquet_path)
+    writer = StoreWriter(directory, model_name=model_name, dtype=dtype)
+    try:
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=["texts", "metadatas", "embeddings"]):
+            texts = batch.column("texts").to_pylist()
+            metadatas = [
+                {key: value for key, value in (metadata or {}).items() if value is not None}
+                for metadata in batch.column("metadatas").to_pylist()
+            ]
+            vectors = batch.column("embeddings").flatten().to_numpy(zero_copy_only=False)
+            writer.append(np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1), texts, metadatas)
+        meta = writer.close()
+        publish_store(writer.version_dir, directory)
+    except BaseException:
+        writer.abort()
+        raise
+    return meta
+
+if __name__ == '__main__':
+    parquet_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(STORE_DIR, "vectorstore.pqt")
+    print(f"🔄 Conversion de {parquet_path}")
+    meta = convert_parquet_store(parquet_path)
+    print(f"✅ {meta['count']} chunks convertis dans {STORE_DIR}")
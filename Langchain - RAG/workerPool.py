@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+
+'''
+   Pool de threads de taille fixe alimenté par une file bornée, pour traiter les questions reçues par l'API Flask.
+
+   Au plus `workers` questions sont traitées en même temps (un seul serveur Ollama et un seul modèle d'embedding) ; les
+   suivantes attendent dans la file, servie dans l'ordre d'arrivée. Quand la file est pleine, ou qu'un client y a déjà
+   trop de questions, submit lève QueueFull avec un délai conseillé avant de réessayer (en-tête Retry-After), estimé à
+   partir de la durée moyenne des derniers traitements.
+
+   La position de chaque question dans la file, sa profondeur et le temps d'attente sont exposés pour le
+   dimensionnement (route /status, /stats et /metrics de app.py).
+
+   SingleFlight regroupe les questions identiques en cours : la première lance le traitement, les suivantes s'y
+   rattachent et reçoivent le même résultat. RequestEvents conserve les événements d'un traitement (tokens de la
+   réponse, verdict de la vérification) pour les transmettre aux clients en streaming.
+
+   Auteur : Cyril Bouvart
+'''
+
+# Nombre de durées de traitement conservées pour estimer le délai Retry-After
+_SAMPLES = 100
+
+class QueueFull(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"File d'attente pleine ({reason}), réessayer dans {retry_after}s")
+        self.reason = reason  # "queue" : file pleine, "client" : trop de questions du même client
+        self.retry_after = retry_after
+
+class WorkerPool:
+    def __init__(self, handler, workers=2, max_queue=32, max_per_client=None, metrics=None):
+        self.handler = handler  # Fonction appelée par les threads : handler(job_id, *args)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client  # Questions en file par client, None pour aucune limite
+        self.metrics = metrics  # tracing.Metrics recevant le temps d'attente et les refus, None pour aucun
+        self.condition = threading.Condition()
+        self.queue = deque()  # (job_id, client_id, args, date d'ajout)
+        self.busy = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.durations = deque(maxlen=_SAMPLES)
+        self.threads = [
+            threading.Thread(target=self._run, name=f"rag-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    # Délai estimé avant qu'une place se libère dans la file (verrou déjà pris)
+    def _retry_after(self):
+        average = sum(self.durations) / len(self.durations) if self.durations else 5.0
+        return max(1, round(average * (len(self.queue) + self.busy) / self.workers))
+
+    def submit(self, job_id, *args, client_id=None):
+        with self.condition:
+            reason = None
+            if len(self.queue) >= self.max_queue:
+                reason = "queue"
+            elif (
+                self.max_per_client is not None and client_id
+                and sum(1 for job in self.queue if job[1] == client_id) >= self.max_per_client
+            ):
+                reason = "client"
+            if reason is not None:
+                self.rejected += 1
+                retry_after = self._retry_after()
+            else:
+                self.queue.append((job_id, client_id, args, time.perf_counter()))
+                self.submitted += 1
+                self.condition.notify()
+                return len(self.queue)
+
+        if self.metrics is not None:
+            self.metrics.inc("rag_queue_rejected_total", (("reason", reason),), help="Questions refusées par la file d'attente")
+        raise QueueFull(reason, retry_after)
+
+    # Position dans la file (1 pour la prochaine question traitée), 0 si la question n'est pas en attente
+    def position(self, job_id):
+        with self.condition:
+            for position, job in enumerate(self.queue, 1):
+                if job[0] == job_id:
+                    return position
+        return 0
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                job_id, _, args, queued = self.queue.popleft()
+                self.busy += 1
+
+            started = time.perf_counter()
+            if self.metrics is not None:
+                self.metrics.observe("rag_queue_wait_seconds", started - queued, help="Temps d'attente dans la file avant traitement")
+            try:
+                self.handler(job_id, *args)
+            except Exception as e:
+                print(f"❌ Erreur du worker : {e}")
+            finally:
+                with self.condition:
+                    self.busy -= 1
+                    self.durations.append(time.perf_counter() - started)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "workers": self.workers,
+                "busy": self.busy,
+                "queued": len(self.queue),
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+            }
+
+# Regroupement des traitements identiques en cours (single-flight) : une clé, un seul traitement, plusieurs demandeurs
+class SingleFlight:
+    def __init__(self, metrics=None):
+        self.metrics = metrics  # tracing.Metrics recevant le nombre de questions regroupées, None pour aucun
+        self.lock = threading.Lock()
+        self.inflight = {}  # Clé -> (identifiants rattachés, le premier lance le traitement ; données partagées)
+        self.leaders = 0
+        self.coalesced = 0
+
+    # (identifiant du traitement en cours auquel job_id est rattaché, données partagées de ce traitement), None à la
+    # place de l'identifiant si job_id doit le lancer avec ses propres données shared. Les données sont renvoyées ici :
+    # le demandeur qui a lancé le traitement peut avoir déjà disparu (mise en file refusée).
+    def join(self, key, job_id, shared=None):
+        with self.lock:
+            entry = self.inflight.get(key)
+            if entry is None:
+                self.inflight[key] = ([job_id], shared)
+                self.leaders += 1
+                return None, shared
+            job_ids, shared = entry
+            job_ids.append(job_id)
+            self.coalesced += 1
+        if self.metrics is not None:
+            self.metrics.inc("rag_coalesced_requests_total", help="Questions rattachées à un traitement identique en cours")
+        return job_ids[0], shared
+
+    # Fin du traitement (ou refus de sa mise en file) : identifiants à qui transmettre le résultat
+    def finish(self, key):
+        with self.lock:
+            return self.inflight.pop(key, ([], None))[0]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "inflight": len(self.inflight),
+                "waiting": sum(len(job_ids) - 1 for job_ids, _ in self.inflight.values()),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
+
+# Événements d'un traitement, lus par un ou plusieurs clients (questions regroupées) depuis le début
+class RequestEvents:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.events = []  # (nom, données)
+        self.closed = False
+
+    def publish(self, name, data):
+        with self.condition:
+            self.events.append((name, data))
+            self.condition.notify_all()
+
+    # Fin du traitement : plus aucun événement
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    # Événements à partir de l'indice start (attente d'au plus timeout secondes s'il n'y en a pas) et fin du traitement
+    def wait(self, start, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.events) > start or self.closed, timeout)
+            return self.events[start:], self.closed